@@ -0,0 +1,436 @@
+"""Offline benchmarks for TelegramIDFetcher using a simulated Telegram client.
+
+No Telegram account is needed: a fake client synthesizes accounts of any
+size (channels, groups, bots and users with emoji-heavy titles), adds
+per-call latency and injects FLOOD_WAIT and USER_ALREADY_PARTICIPANT errors.
+
+The default suite times the dialog crawl, invite-link matching, username
+lookups, detail enrichment and save_results for several account sizes, and
+reports wall time, API calls and peak memory per scenario:
+
+    python benchmark.py --sizes 1000 10000 100000 --latency 0.001
+
+The concurrency scenario compares invite-link throughput for several
+concurrency levels:
+
+    python benchmark.py --scenario concurrency --links 200 --latency 0.05 --flood-rate 0.05
+
+The resolver scenario counts the API calls spent per resolution path for
+links to chats the account is already a member of:
+
+    python benchmark.py --scenario resolver --links 50 --history-scan 200
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from pyrogram import enums
+
+from get_telegram_ids import RateScheduler, TelegramIDFetcher
+
+# Share of each chat type in a synthesized account
+ACCOUNT_MIX = {
+    enums.ChatType.PRIVATE: 0.55,
+    enums.ChatType.CHANNEL: 0.2,
+    enums.ChatType.SUPERGROUP: 0.15,
+    enums.ChatType.GROUP: 0.05,
+    enums.ChatType.BOT: 0.05,
+}
+EMOJIS = ["🎉", "🔥", "🚀", "💎", "✨", "🌍", "📢", "🤖", "💬", "🇺🇦", "🇧🇷", "👨‍👩‍👧‍👦", "🏳️‍🌈"]
+WORDS = ["crypto", "news", "чат", "группа", "deals", "updates", "community", "канал", "trading", "memes"]
+
+
+class FakeFloodWait(Exception):
+    """Stand-in for pyrogram.errors.FloodWait"""
+
+    def __init__(self, value):
+        super().__init__(f"[420 FLOOD_WAIT_X] - A wait of {value} seconds is required")
+        self.value = value
+
+
+def make_chat(chat_id, chat_type, title=None, **fields):
+    return SimpleNamespace(
+        id=chat_id,
+        type=chat_type,
+        title=title,
+        first_name=fields.get('first_name'),
+        username=fields.get('username'),
+        description=fields.get('description'),
+        invite_link=fields.get('invite_link'),
+    )
+
+
+def make_account(size, seed=0, prefix=''):
+    """Synthesize `size` chats with ACCOUNT_MIX types, most recent first.
+
+    About 60% have a username and 30% of channels and groups advertise an
+    invite link https://t.me/+<prefix>inv<n> in their description.
+    """
+    rng = random.Random(seed)
+    types = rng.choices(list(ACCOUNT_MIX), weights=list(ACCOUNT_MIX.values()), k=size)
+    chats = []
+    for n, chat_type in enumerate(types):
+        title = f"{rng.choice(WORDS)} {''.join(rng.choices(EMOJIS, k=rng.randint(1, 6)))} {n}"
+        username = f"{prefix}{chat_type.name.lower()}_{n}" if rng.random() < 0.6 else None
+        if chat_type in (enums.ChatType.PRIVATE, enums.ChatType.BOT):
+            chats.append(make_chat(100000 + n, chat_type, first_name=title, username=username))
+            continue
+        chat_id = -100000 - n if chat_type == enums.ChatType.GROUP else -1001000000000 - n
+        description = None
+        if rng.random() < 0.3:
+            description = f"{title} — join us https://t.me/+{prefix}inv{n}"
+        chats.append(make_chat(chat_id, chat_type, title, username=username, description=description))
+    return chats
+
+
+class FakeRPCError(Exception):
+    """Stand-in for other pyrogram.errors RPC errors"""
+
+
+class FakeClient:
+    """Minimal stand-in for pyrogram.Client.
+
+    Every API call sleeps for `latency` seconds and fails with FakeFloodWait
+    with probability `flood_rate`. Calls are counted per method in `calls`.
+
+    `members` maps invite links to chats the account is already in: joining
+    them fails with USER_ALREADY_PARTICIPANT, and get_chat() only returns
+    them for links in `checkable`. Joining any other link fails the same way
+    with probability `participant_rate`. `history` maps chat ids to message
+    texts, and `directory` holds chats outside the dialogs that can still be
+    looked up by username. get_chat() by id returns a dialog's chat with the
+    full details (member count, linked chat) that get_dialogs() leaves out.
+    """
+
+    def __init__(self, chats=(), latency=0.0, flood_rate=0.0, flood_wait=1, seed=0,
+                 members=None, checkable=(), history=None, participant_rate=0.0, directory=()):
+        self.chats = list(chats)
+        self.members = members or {}
+        self.checkable = set(checkable)
+        self.history = history or {}
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.participant_rate = participant_rate
+        self.random = random.Random(seed)
+        self.calls = {}
+        self.joined = {}
+        self.usernames = {chat.username.lower(): chat for chat in [*directory, *self.chats] if chat.username}
+        self.by_id = {chat.id: chat for chat in self.chats}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def _api_call(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            raise FakeFloodWait(self.flood_wait)
+
+    async def get_dialogs(self, limit=0):
+        # Pyrogram fetches dialogs in pages of 100
+        now = datetime.datetime.now()
+        for offset in range(0, len(self.chats), 100):
+            while True:
+                try:
+                    await self._api_call('get_dialogs')
+                    break
+                except FakeFloodWait as e:
+                    # Pyrogram sleeps through short waits inside the generator
+                    await asyncio.sleep(e.value)
+            for position, chat in enumerate(self.chats[offset:offset + 100], offset):
+                top_message = SimpleNamespace(id=10 ** 7 - position, date=now - datetime.timedelta(minutes=position))
+                yield SimpleNamespace(chat=chat, top_message=top_message, is_pinned=False)
+
+    async def join_chat(self, link):
+        await self._api_call('join_chat')
+        if link in self.members or (self.participant_rate and self.random.random() < self.participant_rate):
+            raise FakeRPCError("[400 USER_ALREADY_PARTICIPANT] - The user is already a participant of this chat")
+        if link not in self.joined:
+            chat_id = -1002000000000 - len(self.joined)
+            self.joined[link] = make_chat(chat_id, enums.ChatType.SUPERGROUP, f"Joined {len(self.joined)}")
+        return self.joined[link]
+
+    def _find_username(self, username):
+        chat = self.usernames.get(str(username).lower())
+        if chat is None:
+            raise FakeRPCError(f"[400 USERNAME_NOT_OCCUPIED] - The username {username} is not occupied by anyone")
+        return chat
+
+    async def get_users(self, user_ids):
+        # Pyrogram resolves every username with its own request
+        users = []
+        for username in user_ids:
+            await self._api_call('get_users')
+            chat = self._find_username(username)
+            if chat.type not in (enums.ChatType.PRIVATE, enums.ChatType.BOT):
+                raise FakeRPCError("[400 PEER_ID_INVALID] - The peer id being used is invalid")
+            users.append(SimpleNamespace(id=chat.id, first_name=chat.first_name, username=chat.username,
+                                         is_bot=chat.type == enums.ChatType.BOT))
+        return users
+
+    async def get_chat(self, chat_id):
+        await self._api_call('get_chat')
+        if isinstance(chat_id, int):
+            chat = self.by_id.get(chat_id)
+            if chat is None:
+                raise FakeRPCError("[400 PEER_ID_INVALID] - The peer id being used is invalid")
+            linked_chat = SimpleNamespace(id=chat.id - 1) if chat.type == enums.ChatType.CHANNEL else None
+            return SimpleNamespace(**vars(chat), members_count=abs(chat.id) % 5000, linked_chat=linked_chat)
+        if 't.me/' not in str(chat_id):
+            return self._find_username(chat_id)
+        if chat_id in self.checkable:
+            return self.members[chat_id]
+        if chat_id in self.members:
+            # Telegram only returns a preview for some invites
+            return SimpleNamespace(title=self.members[chat_id].title, type=self.members[chat_id].type)
+        raise FakeRPCError("[400 INVITE_HASH_EXPIRED] - The chat invite link is no longer valid")
+
+    async def get_chat_history(self, chat_id, limit=0):
+        await self._api_call('get_chat_history')
+        for text in self.history.get(chat_id, [])[:limit or None]:
+            yield SimpleNamespace(text=text)
+
+
+def suite_client(chats, args, **kwargs):
+    return FakeClient(chats, latency=args.latency, flood_rate=args.flood_rate, flood_wait=args.flood_wait,
+                      seed=args.seed, **kwargs)
+
+
+def suite_fetcher(args, **kwargs):
+    return TelegramIDFetcher(concurrency=args.concurrency[-1], scheduler=RateScheduler(backoff=args.flood_wait / 10),
+                             **kwargs)
+
+
+async def crawl_scenario(chats, args):
+    """Crawl, index, de-duplicate and categorize every dialog"""
+    client = suite_client(chats, args)
+    fetcher = suite_fetcher(args)
+    start = time.perf_counter()
+    await fetcher.fetch_with_client(client)
+    return time.perf_counter() - start, client.calls, len(fetcher.results)
+
+
+async def invite_links_scenario(chats, args):
+    """Match invite links: a third advertised by dialogs, the rest new or already joined"""
+    links = [chat.description.rsplit(' ', 1)[1] for chat in chats if chat.description][:args.links // 3]
+    members = {}
+    for n in range(args.links - len(links)):
+        link = f"https://t.me/+other{n}"
+        if n % 2:
+            members[link] = chats[n % len(chats)]
+        links.append(link)
+    client = suite_client(chats, args, members=members, checkable=list(members)[::2],
+                          participant_rate=args.participant_rate)
+    fetcher = suite_fetcher(args)
+    start = time.perf_counter()
+    await fetcher.fetch_with_client(client, links)
+    return time.perf_counter() - start, client.calls, len(fetcher.results)
+
+
+async def usernames_scenario(chats, args):
+    """Look up usernames: half in the dialogs, half only known to the server"""
+    usernames = [chat.username for chat in chats if chat.username][:args.links // 2]
+    directory = [chat for chat in make_account(args.links, args.seed + 1, prefix='dir_') if chat.username]
+    for chat in directory[:args.links - len(usernames)]:
+        chat.id += 10 ** 9 if chat.id > 0 else -10 ** 9
+        usernames.append(chat.username)
+    client = suite_client(chats, args, directory=directory)
+    fetcher = suite_fetcher(args)
+    start = time.perf_counter()
+    await fetcher.fetch_with_client(client, usernames=usernames)
+    return time.perf_counter() - start, client.calls, len(fetcher.results)
+
+
+async def enrich_scenario(chats, args):
+    """Crawl, then fetch full details of every channel and group"""
+    client = suite_client(chats, args)
+    fetcher = suite_fetcher(args, enrich=['channels', 'groups'])
+    start = time.perf_counter()
+    await fetcher.fetch_with_client(client)
+    return time.perf_counter() - start, client.calls, len(fetcher.results)
+
+
+async def save_scenario(chats, args):
+    """Write telegram_ids.json and list the results for a crawled account"""
+    client = suite_client(chats, args)
+    fetcher = suite_fetcher(args)
+    await fetcher.fetch_with_client(client)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            start = time.perf_counter()
+            fetcher.save_results()
+            elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    return elapsed, {}, len(fetcher.results)
+
+
+SCENARIOS = {
+    'crawl': crawl_scenario,
+    'invite_links': invite_links_scenario,
+    'usernames': usernames_scenario,
+    'enrich': enrich_scenario,
+    'save': save_scenario,
+}
+
+
+async def run_suite_scenario(scenario, chats, args):
+    """Return (seconds, calls by method, entities, peak bytes or None) for one scenario"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        seconds, calls, entities = await scenario(chats, args)
+        peak = None
+        if args.memory:
+            # Trace a second run so tracemalloc overhead does not skew the timing
+            tracemalloc.start()
+            try:
+                await scenario(chats, args)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    return seconds, calls, entities, peak
+
+
+async def run_suite(args):
+    print(f"{args.latency * 1000:.0f}ms latency, {args.flood_rate:.0%} FLOOD_WAIT rate ({args.flood_wait}s), "
+          f"{args.participant_rate:.0%} already joined, {args.links} links/usernames, "
+          f"concurrency {args.concurrency[-1]}")
+    print(f"{'scenario':>12}  {'dialogs':>8}  {'seconds':>8}  {'API calls':>9}  {'peak MB':>8}  {'entities':>8}")
+    for size in args.sizes:
+        chats = make_account(size, args.seed)
+        for name in args.scenarios:
+            seconds, calls, entities, peak = await run_suite_scenario(SCENARIOS[name], chats, args)
+            peak = f"{peak / 2 ** 20:.1f}" if peak is not None else "-"
+            print(f"{name:>12}  {size:>8}  {seconds:>8.3f}  {sum(calls.values()):>9}  {peak:>8}  {entities:>8}")
+
+
+async def run_invite_links(links, concurrency, latency, flood_rate, flood_wait):
+    client = FakeClient(latency=latency, flood_rate=flood_rate, flood_wait=flood_wait)
+    fetcher = TelegramIDFetcher(
+        concurrency=concurrency,
+        scheduler=RateScheduler(backoff=flood_wait / 10),
+    )
+    invite_links = [f"https://t.me/+bench{i}" for i in range(links)]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await fetcher.fetch_with_client(client, invite_links)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'links_per_second': links / elapsed if elapsed else float('inf'),
+        'resolved': len(fetcher.results['invite_links']),
+        'calls': sum(client.calls.values()),
+    }
+
+
+async def run_resolver_paths(links, dialogs, history_budget):
+    """Resolve links to chats the account is already in, a third by each path"""
+    chats = [make_chat(-1001000000000 - i, enums.ChatType.SUPERGROUP, f"Group {i}") for i in range(dialogs)]
+    members = {}
+    checkable = []
+    history = {}
+    for i in range(links):
+        link = f"https://t.me/+member{i}"
+        chat = chats[(i * 7) % dialogs]
+        members[link] = chat
+        if i % 3 == 0:
+            checkable.append(link)
+        elif i % 3 == 1:
+            chat.description = f"Join us: {link}"
+        else:
+            history.setdefault(chat.id, []).append(f"Invite: {link}")
+
+    client = FakeClient(chats, members=members, checkable=checkable, history=history)
+    fetcher = TelegramIDFetcher(history_budget=history_budget)
+    with contextlib.redirect_stdout(io.StringIO()):
+        await fetcher.fetch_with_client(client, list(members))
+
+    return fetcher, client.calls
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark TelegramIDFetcher against a simulated Telegram client")
+    parser.add_argument('--scenario', choices=['suite', 'concurrency', 'resolver'], default='suite',
+                        help="what to measure (default: suite)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="account sizes in dialogs (suite, default: 1000 10000 100000)")
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS),
+                        help="scenarios to run (suite, default: all)")
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="skip the tracemalloc run that measures peak memory (suite)")
+    parser.add_argument('--seed', type=int, default=0, help="seed for synthesized accounts (suite)")
+    parser.add_argument('--links', type=int, default=100, help="number of invite links or usernames to resolve")
+    parser.add_argument('--latency', type=float,
+                        help="simulated seconds per API call (default: 0.05, suite: 0)")
+    parser.add_argument('--flood-rate', type=float,
+                        help="probability of FLOOD_WAIT per call (default: 0.05, suite: 0)")
+    parser.add_argument('--flood-wait', type=float, default=0.5, help="simulated FLOOD_WAIT duration in seconds")
+    parser.add_argument('--participant-rate', type=float, default=0.0,
+                        help="probability that joining a new link fails with USER_ALREADY_PARTICIPANT (suite)")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help="concurrency levels to compare (the suite uses the last one)")
+    parser.add_argument('--dialogs', type=int, default=500, help="dialogs in the simulated account (resolver)")
+    parser.add_argument('--history-scan', type=int, default=0,
+                        help="history scan budget per link (resolver, default: 0, disabled)")
+    args = parser.parse_args()
+
+    # Keep the fetcher's progress messages out of the report
+    logging.getLogger('telegram_ids').addHandler(logging.NullHandler())
+    logging.getLogger('telegram_ids').propagate = False
+
+    if args.scenario == 'suite':
+        args.latency = args.latency or 0.0
+        args.flood_rate = args.flood_rate or 0.0
+        await run_suite(args)
+        return
+
+    if args.scenario == 'resolver':
+        fetcher, calls = await run_resolver_paths(args.links, args.dialogs, args.history_scan)
+        resolver = fetcher.resolver
+        print(f"{args.links} already-joined invite links, {args.dialogs} dialogs, "
+              f"history scan budget {args.history_scan}")
+        print(f"{'path':>12}  {'resolved':>8}  {'API calls':>9}")
+        for path in resolver.PATHS:
+            print(f"{path:>12}  {resolver.resolved[path]:>8}  {resolver.calls[path]:>9}")
+        before_join = len(fetcher.results['invite_links']) - sum(resolver.resolved.values())
+        print(f"Resolved from the dialog index before joining: {before_join}")
+        print(f"Calls by method: {calls}")
+        return
+
+    latency = 0.05 if args.latency is None else args.latency
+    flood_rate = 0.05 if args.flood_rate is None else args.flood_rate
+    print(f"{args.links} invite links, {latency * 1000:.0f}ms latency, "
+          f"{flood_rate:.0%} FLOOD_WAIT rate ({args.flood_wait}s)")
+    print(f"{'concurrency':>11}  {'seconds':>8}  {'links/s':>8}  {'resolved':>8}  {'calls':>6}")
+    for concurrency in args.concurrency:
+        result = await run_invite_links(args.links, concurrency, latency, flood_rate, args.flood_wait)
+        print(f"{result['concurrency']:>11}  {result['seconds']:>8.2f}  {result['links_per_second']:>8.1f}  "
+              f"{result['resolved']:>8}  {result['calls']:>6}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
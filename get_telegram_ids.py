@@ -1,290 +1,1795 @@
-from pyrogram import Client, enums
+import argparse
 import asyncio
+import contextlib
+import itertools
 import json
+import logging
 import sys
 import os
-from dotenv import load_dotenv
+import re
+import sqlite3
+import time
+import urllib.parse
+
+logger = logging.getLogger('telegram_ids')
+
+DEFAULT_CONCURRENCY = 4
+FAILOVER_FLOOD_WAIT = 60  # seconds; longer flood waits move work to another account
+# Errors after which an account cannot join chats for the rest of the run
+ACCOUNT_LIMIT_ERRORS = (
+    'CHANNELS_TOO_MUCH', 'USER_BANNED_IN_CHANNEL', 'USER_RESTRICTED', 'PEER_FLOOD',
+)
+# Errors after which an account's session cannot make any call for the rest of the run
+ACCOUNT_DEAD_ERRORS = ('USER_DEACTIVATED', 'AUTH_KEY_UNREGISTERED', 'SESSION_REVOKED')
+OUTPUT_FILE = 'telegram_ids.json'
+STREAM_FILE = 'telegram_ids.ndjson'
+CACHE_FILE = 'telegram_ids_cache.sqlite'
+DEFAULT_CACHE_MAX_AGE = 24 * 60 * 60  # seconds
+CHECKPOINT_FILE = 'telegram_ids_checkpoint.ndjson'
+DEFAULT_CHECKPOINT_INTERVAL = 30  # seconds
+QUERY_INDEX_FILE = 'telegram_ids_index.sqlite'
+QUERY_INDEX_MIN_SIZE = 1024 * 1024  # bytes; smaller output files are scanned directly
+QUERY_MMAP_SIZE = 256 * 1024 * 1024  # bytes
+
+INVITE_LINK_RE = re.compile(r'(?:\+|joinchat/)([\w-]+)')
+TOKEN_RE = re.compile(r'[\w-]+')
+INVITE_TARGET_RE = re.compile(r'(?:https?://)?(?:www\.)?(?:t|telegram)\.me/(?:\+|joinchat/)([\w-]+)/?$', re.IGNORECASE)
+USERNAME_TARGET_RE = re.compile(r'(?:(?:https?://)?(?:www\.)?(?:t|telegram)\.me/|@)?([A-Za-z]\w{3,31})(?:/\d+)?/?$', re.IGNORECASE)
+
+# Output categories, in the order they appear in telegram_ids.json
+CATEGORIES = ('channels', 'groups', 'bots', 'usernames')
+CATEGORY_BY_TYPE = {
+    'ChatType.CHANNEL': 'channels',
+    'ChatType.GROUP': 'groups',
+    'ChatType.SUPERGROUP': 'groups',
+    'ChatType.BOT': 'bots',
+    'ChatType.PRIVATE': 'usernames',
+}
+CATEGORY_LABELS = {
+    'channels': 'channel',
+    'groups': 'group',
+    'bots': 'bot',
+    'usernames': 'user',
+}
+
+
+def invite_hash_from_link(link):
+    """Extract the invite hash from a t.me/+hash or t.me/joinchat/hash link"""
+    if not link:
+        return None
+    match = INVITE_LINK_RE.search(link)
+    return match.group(1) if match else None
+
+
+def normalize_target(text):
+    """Normalize an invite link or username.
+
+    Returns ('invite_link', 'https://t.me/+hash'), ('username', 'name') or
+    None if the text is neither.
+    """
+    text = text.strip()
+    match = INVITE_TARGET_RE.match(text)
+    if match:
+        return 'invite_link', f"https://t.me/+{match.group(1)}"
+    match = USERNAME_TARGET_RE.match(text)
+    if match:
+        return 'username', match.group(1)
+    return None
+
+
+def read_targets(lines):
+    """Yield normalized, de-duplicated targets from an iterable of lines.
+
+    Blank lines and lines starting with # are skipped; usernames are compared
+    case-insensitively.
+    """
+    seen = set()
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        target = normalize_target(line)
+        if target is None:
+            logger.warning(f"Ignoring unrecognized input: {line}")
+            continue
+        key = (target[0], target[1].lower() if target[0] == 'username' else target[1])
+        if key in seen:
+            continue
+        seen.add(key)
+        yield target
+
+
+async def recent_message_texts(app, chat_id, limit=5):
+    """Return the text of the most recent messages in a chat"""
+    texts = []
+    async for message in app.get_chat_history(chat_id, limit=limit):
+        if hasattr(message, 'text') and message.text:
+            texts.append(message.text)
+    return texts
+
+
+async def list_dialogs(app, offset=None, skip=0):
+    """Yield the dialogs of an account, newest first, continuing after a saved position.
+
+    Pyrogram's get_dialogs() always starts from the newest dialog, so with an
+    offset (top message id, top message date, chat id) the raw GetDialogs
+    pager is used from there. Clients without the raw API list everything
+    again and skip the first `skip` dialogs.
+    """
+    if offset is None or not hasattr(app, 'invoke'):
+        listed = 0
+        async for dialog in app.get_dialogs():
+            listed += 1
+            if listed > skip:
+                yield dialog
+        return
+
+    from pyrogram import raw, types, utils
+
+    offset_id, offset_date, chat_id = offset
+    try:
+        offset_peer = await app.resolve_peer(chat_id)
+    except Exception:
+        # An in-memory session may not know the peer yet; the date alone still pages correctly
+        offset_peer = raw.types.InputPeerEmpty()
+    while True:
+        r = await app.invoke(
+            raw.functions.messages.GetDialogs(
+                offset_date=int(offset_date or 0), offset_id=offset_id or 0, offset_peer=offset_peer,
+                limit=100, hash=0
+            ),
+            sleep_threshold=60
+        )
+        users = {user.id: user for user in r.users}
+        chats = {chat.id: chat for chat in r.chats}
+        messages = {}
+        for message in r.messages:
+            if isinstance(message, raw.types.MessageEmpty):
+                continue
+            messages[utils.get_peer_id(message.peer_id)] = await types.Message._parse(
+                app, message, users, chats, replies=0
+            )
+        dialogs = [
+            types.Dialog._parse(app, dialog, messages, users, chats)
+            for dialog in r.dialogs if isinstance(dialog, raw.types.Dialog)
+        ]
+        if not dialogs:
+            return
+        for dialog in dialogs:
+            yield dialog
+
+        last = dialogs[-1]
+        if not last.top_message:
+            return
+        offset_id = last.top_message.id
+        offset_date = utils.datetime_to_timestamp(last.top_message.date)
+        try:
+            offset_peer = await app.resolve_peer(last.chat.id)
+        except Exception:
+            offset_peer = raw.types.InputPeerEmpty()
+
+
+def chat_title(chat):
+    """Return a display title for a chat, falling back to the user's name"""
+    return chat.title or chat.first_name or chat.username or "Unknown"
+
+
+class Entity:
+    """A resolved Telegram entity.
+
+    A single record is shared by reference between the category it belongs to
+    and the invite_links view, instead of being copied into both.
+
+    invite_link is the link the entity was resolved from; chat_invite_link is
+    the chat's own link. It is one of the full chat details, along with
+    members_count and linked_chat_id, that only get_chat() returns.
+    """
+
+    __slots__ = ('title', 'username', 'id', 'type', 'description', 'invite_link',
+                 'members_count', 'linked_chat_id', 'chat_invite_link')
+
+    def __init__(self, id, type, title="Unknown", username=None, description=None, invite_link=None,
+                 members_count=None, linked_chat_id=None, chat_invite_link=None):
+        self.title = title
+        self.username = username
+        self.id = id
+        self.type = type
+        self.description = description
+        self.invite_link = invite_link
+        self.members_count = members_count
+        self.linked_chat_id = linked_chat_id
+        self.chat_invite_link = chat_invite_link
+
+    @classmethod
+    def from_chat(cls, chat, invite_link=None):
+        """Build an entity from a Pyrogram chat"""
+        entity = cls(
+            id=chat.id,
+            type=str(chat.type),
+            title=chat_title(chat),
+            username=chat.username if hasattr(chat, 'username') else None,
+            invite_link=invite_link,
+        )
+        entity.set_details(chat)
+        return entity
+
+    def set_details(self, chat):
+        """Copy the full chat details of a Pyrogram chat; dialog chats mostly have none"""
+        self.description = getattr(chat, 'description', None)
+        self.members_count = getattr(chat, 'members_count', None)
+        linked_chat = getattr(chat, 'linked_chat', None)
+        self.linked_chat_id = linked_chat.id if linked_chat else None
+        self.chat_invite_link = getattr(chat, 'invite_link', None)
+
+    def details(self):
+        """Return the full chat details that are known, by output field"""
+        fields = ('description', 'members_count', 'linked_chat_id', 'chat_invite_link')
+        return {field: getattr(self, field) for field in fields if getattr(self, field) is not None}
+
+    @property
+    def category(self):
+        """The output category for this entity, or None if it has none"""
+        return CATEGORY_BY_TYPE.get(self.type)
+
+    def to_dict(self):
+        """Return the JSON representation used in telegram_ids.json"""
+        info = {
+            'title': self.title,
+            'username': self.username,
+            'id': self.id,
+            'type': self.type,
+            'description': self.description
+        }
+        if self.invite_link:
+            info['invite_link'] = self.invite_link
+        # Full chat details are only known after enrichment
+        for field in ('members_count', 'linked_chat_id', 'chat_invite_link'):
+            if getattr(self, field) is not None:
+                info[field] = getattr(self, field)
+        return info
+
+
+class NDJSONWriter:
+    """Streams categorized entities to an NDJSON file as they are found.
+
+    Each line is one entity with its 'category'. Lines are flushed in batches,
+    so a crash loses at most one batch, and with resume=True a partial file is
+    continued: entities and invite links already in it are not written again.
+
+    Fields learned after an entity was written (the invite link it was
+    resolved from, enriched details) follow on a later line holding only its
+    'category', 'id' and the new fields; readers merge lines by id.
+    """
+
+    def __init__(self, path=STREAM_FILE, batch_size=100, resume=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.seen_ids = set()
+        self.seen_links = set()
+        self.counts = {category: 0 for category in CATEGORIES}
+        self.pending = []
+
+        if resume and os.path.exists(path):
+            self.load(path)
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def load(self, path):
+        """Read the entities of a partial file, dropping a truncated last line"""
+        valid_size = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                valid_size += len(line)
+                if item['id'] not in self.seen_ids and item.get('category') in self.counts:
+                    self.counts[item['category']] += 1
+                self.seen_ids.add(item['id'])
+                if item.get('invite_link'):
+                    self.seen_links.add(item['invite_link'])
+        with open(path, 'r+b') as f:
+            f.truncate(valid_size)
+        logger.info(f"Resuming {path}: {len(self.seen_ids)} entities already saved")
+
+    def write(self, entity):
+        """Queue an entity for writing; return False if it was already written"""
+        if not entity.category:
+            return False
+        if entity.id in self.seen_ids:
+            if entity.invite_link and entity.invite_link not in self.seen_links:
+                self.update(entity, {'invite_link': entity.invite_link})
+            return False
+        self.seen_ids.add(entity.id)
+        if entity.invite_link:
+            self.seen_links.add(entity.invite_link)
+        self.counts[entity.category] += 1
+        self.queue({'category': entity.category, **entity.to_dict()})
+        return True
+
+    def update(self, entity, fields):
+        """Queue a line adding fields to an entity written earlier"""
+        if fields.get('invite_link'):
+            self.seen_links.add(fields['invite_link'])
+        self.queue({'category': entity.category, 'id': entity.id, **fields})
+
+    def queue(self, item):
+        self.pending.append(json.dumps(item, ensure_ascii=False))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write('\n'.join(self.pending) + '\n')
+            self.pending = []
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class EntityStore:
+    """Id-keyed store of resolved entities.
+
+    Each entity is stored once; category lists are derived on demand in
+    insertion order. With a writer, entities are streamed out as they are
+    added and only their ids are kept.
+    """
+
+    def __init__(self, writer=None):
+        self.entities = {}
+        self.writer = writer
+
+    def add(self, entity):
+        """Store an entity unless its id is already known; return the stored record"""
+        if self.writer:
+            self.writer.write(entity)
+            return entity
+        existing = self.entities.get(entity.id)
+        if existing is None:
+            self.entities[entity.id] = entity
+            return entity
+        if entity.invite_link and not existing.invite_link:
+            existing.invite_link = entity.invite_link
+        return existing
+
+    def update(self, entity, fields):
+        """Record fields learned about an entity after it was added.
+
+        Stored entities are shared with the dialog index and already hold
+        them; streamed ones get an extra line.
+        """
+        if self.writer and fields and entity.id in self.writer.seen_ids:
+            self.writer.update(entity, fields)
+
+    def category(self, name):
+        """Return the entities of a category ('invite_links' lists entities resolved from links)"""
+        if name == 'invite_links':
+            return [entity for entity in self.entities.values() if entity.invite_link]
+        return [entity for entity in self.entities.values() if entity.category == name]
+
+    def to_dict(self):
+        """Return the categorized JSON representation"""
+        results = {category: [] for category in CATEGORIES}
+        for entity in self.entities.values():
+            if entity.category:
+                results[entity.category].append(entity.to_dict())
+        return results
+
+    def __getitem__(self, name):
+        return self.category(name)
+
+    def __contains__(self, entity_id):
+        if self.writer:
+            return entity_id in self.writer.seen_ids
+        return entity_id in self.entities
+
+    def __len__(self):
+        if self.writer:
+            return len(self.writer.seen_ids)
+        return len(self.entities)
+
+
+class EntityCache:
+    """SQLite cache of resolved entities and invite hashes, kept between runs.
+
+    Entities are stored with the id and date of their dialog's top message so
+    the next run only needs to crawl dialogs with newer activity. A full crawl
+    is forced once the last one is older than max_age seconds; entities not
+    seen by it and invite hashes older than max_age are evicted. Full chat
+    details are stored with their own timestamp and are refetched once older
+    than max_age.
+    """
+
+    DETAIL_COLUMNS = {
+        'members_count': 'INTEGER',
+        'linked_chat_id': 'INTEGER',
+        'chat_invite_link': 'TEXT',
+        'details_at': 'REAL',
+        # 0 for chats only cached for their details (e.g. dialogs of other accounts)
+        'is_dialog': 'INTEGER DEFAULT 1',
+    }
+
+    def __init__(self, path=CACHE_FILE, max_age=DEFAULT_CACHE_MAX_AGE, refresh=False):
+        self.path = path
+        self.max_age = max_age
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS entities (
+                id INTEGER PRIMARY KEY,
+                title TEXT,
+                username TEXT,
+                type TEXT,
+                description TEXT,
+                top_message_id INTEGER,
+                top_message_date REAL,
+                updated_at REAL,
+                members_count INTEGER,
+                linked_chat_id INTEGER,
+                chat_invite_link TEXT,
+                details_at REAL,
+                is_dialog INTEGER DEFAULT 1
+            );
+            CREATE TABLE IF NOT EXISTS invites (
+                hash TEXT PRIMARY KEY,
+                chat_id INTEGER,
+                resolved_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        # Caches created before details were stored lack their columns
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(entities)")}
+        with self.db:
+            for column, column_type in self.DETAIL_COLUMNS.items():
+                if column not in columns:
+                    self.db.execute(f"ALTER TABLE entities ADD COLUMN {column} {column_type}")
+        self.stats = {'dialogs': [0, 0], 'invite_links': [0, 0], 'details': [0, 0]}  # [hits, lookups]
+        if refresh:
+            self.clear()
+        self.evict()
+
+    def clear(self):
+        """Drop everything, forcing a full crawl"""
+        with self.db:
+            self.db.execute("DELETE FROM entities")
+            self.db.execute("DELETE FROM invites")
+            self.db.execute("DELETE FROM meta")
+
+    def evict(self):
+        """Drop invite hashes resolved more than max_age seconds ago"""
+        with self.db:
+            self.db.execute("DELETE FROM invites WHERE resolved_at < ?", (time.time() - self.max_age,))
+
+    def needs_full_crawl(self):
+        """True if the last full dialog crawl is missing or older than max_age"""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'full_crawl_at'").fetchone()
+        return row is None or time.time() - float(row[0]) > self.max_age
+
+    def finish_full_crawl(self, started_at):
+        """Record a completed full crawl and evict entities it did not see"""
+        with self.db:
+            self.db.execute("DELETE FROM entities WHERE updated_at < ?", (started_at,))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('full_crawl_at', ?)", (str(started_at),))
+
+    def load_top_messages(self):
+        """Return {id: top_message_id} of the cached entities"""
+        return dict(self.db.execute("SELECT id, top_message_id FROM entities WHERE is_dialog"))
+
+    def iter_entities(self, ids=None):
+        """Yield the cached entities (only those in ids, if given) by most recent activity.
+
+        Rows are read from a cursor, so the entities are never all in memory at once.
+        """
+        rows = self.db.execute(
+            "SELECT id, title, username, type, description, "
+            "members_count, linked_chat_id, chat_invite_link FROM entities "
+            "WHERE is_dialog ORDER BY top_message_date DESC"
+        )
+        for row in rows:
+            if ids is None or row[0] in ids:
+                yield Entity(id=row[0], title=row[1], username=row[2], type=row[3], description=row[4],
+                             members_count=row[5], linked_chat_id=row[6], chat_invite_link=row[7])
+
+    def get_entity(self, chat_id):
+        """Return the cached entity of a chat, or None"""
+        row = self.db.execute(
+            "SELECT id, title, username, type, description, members_count, linked_chat_id, chat_invite_link "
+            "FROM entities WHERE id = ?", (chat_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return Entity(id=row[0], title=row[1], username=row[2], type=row[3], description=row[4],
+                      members_count=row[5], linked_chat_id=row[6], chat_invite_link=row[7])
+
+    def save_entity(self, entity, top_message_id=None, top_message_date=None):
+        # Dialog chats carry no description, so a crawl keeps the one stored by enrichment
+        self.db.execute(
+            "INSERT INTO entities (id, title, username, type, description, top_message_id, top_message_date, "
+            "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET title = excluded.title, username = excluded.username, "
+            "type = excluded.type, description = COALESCE(excluded.description, description), "
+            "top_message_id = excluded.top_message_id, top_message_date = excluded.top_message_date, "
+            "updated_at = excluded.updated_at, is_dialog = 1",
+            (entity.id, entity.title, entity.username, entity.type, entity.description,
+             top_message_id, top_message_date, time.time())
+        )
+
+    def get_details(self, chat_id):
+        """Return (description, members_count, linked_chat_id, chat_invite_link) if fetched within max_age"""
+        return self.db.execute(
+            "SELECT description, members_count, linked_chat_id, chat_invite_link FROM entities "
+            "WHERE id = ? AND details_at >= ?",
+            (chat_id, time.time() - self.max_age)
+        ).fetchone()
+
+    def save_details(self, entity):
+        # Chats the crawl did not cache (other accounts' dialogs) get a row of their own
+        now = time.time()
+        self.db.execute(
+            "INSERT INTO entities (id, title, username, type, description, members_count, linked_chat_id, "
+            "chat_invite_link, details_at, updated_at, is_dialog) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0) "
+            "ON CONFLICT (id) DO UPDATE SET description = excluded.description, "
+            "members_count = excluded.members_count, linked_chat_id = excluded.linked_chat_id, "
+            "chat_invite_link = excluded.chat_invite_link, details_at = excluded.details_at",
+            (entity.id, entity.title, entity.username, entity.type, entity.description, entity.members_count,
+             entity.linked_chat_id, entity.chat_invite_link, now, now)
+        )
+
+    def get_invite(self, invite_hash):
+        """Return the chat id an invite hash was resolved to, if cached"""
+        row = self.db.execute("SELECT chat_id FROM invites WHERE hash = ?", (invite_hash,)).fetchone()
+        return row[0] if row else None
+
+    def save_invite(self, invite_hash, chat_id):
+        self.db.execute("INSERT OR REPLACE INTO invites VALUES (?, ?, ?)", (invite_hash, chat_id, time.time()))
+
+    def record(self, kind, hit):
+        """Count a cache lookup for the hit-rate report"""
+        self.stats[kind][0] += int(hit)
+        self.stats[kind][1] += 1
+
+    def report(self):
+        logger.info("\nCache hit rates:")
+        for kind, (hits, lookups) in self.stats.items():
+            rate = hits / lookups if lookups else 0
+            logger.info(f"  {kind}: {hits}/{lookups} ({rate:.1%})")
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class Checkpoint:
+    """Journal of a run's progress, so an interrupted run can be resumed.
+
+    Crawled dialogs (with the pagination position after each), resolved
+    invite links and looked-up usernames are appended as NDJSON records.
+    Records are flushed every `interval` seconds and on close, so a crash or
+    Ctrl-C loses at most one interval of work. The file is only created once
+    there is a record to write, so a run that fails before doing anything
+    leaves no checkpoint behind. With resume=True the records of the previous
+    run are loaded first and appended to; otherwise an existing file is
+    started over, so main() refuses to run over one that has records unless
+    --resume is given.
+    """
+
+    def __init__(self, path=CHECKPOINT_FILE, interval=DEFAULT_CHECKPOINT_INTERVAL, resume=False):
+        self.path = path
+        self.interval = interval
+        # account number -> {'started_at', 'entities', 'offset', 'listed', 'done'}
+        self.crawls = {}
+        self.links = {}
+        self.usernames = {}
+        self.pending = []
+        self.flushed_at = time.monotonic()
+
+        if resume and os.path.exists(path):
+            self.load(path)
+        self.mode = 'a' if resume else 'w'
+        self.file = None
+
+    @staticmethod
+    def has_records(path):
+        """Return whether a checkpoint file holds at least one complete record"""
+        try:
+            with open(path, 'rb') as f:
+                line = f.readline()
+        except FileNotFoundError:
+            return False
+        try:
+            json.loads(line)
+        except ValueError:
+            return False
+        return line.endswith(b'\n')
+
+    def load(self, path):
+        """Read the records of a previous run, dropping a truncated last line"""
+        valid_size = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                valid_size += len(line)
+                self.apply(record)
+        with open(path, 'r+b') as f:
+            f.truncate(valid_size)
+        dialogs = sum(len(crawl['entities']) for crawl in self.crawls.values())
+        logger.info(f"Resuming from {path}: {dialogs} dialogs, {len(self.links)} invite links "
+                    f"and {len(self.usernames)} usernames already done")
+
+    def apply(self, record):
+        if 'crawl' in record:
+            self.crawls[record['crawl']] = {
+                'started_at': record['started_at'], 'entities': {}, 'offset': None, 'listed': 0, 'done': False,
+            }
+        elif 'dialog' in record:
+            crawl = self.crawls[record['dialog']]
+            entity = Entity(**record['entity'])
+            crawl['entities'][entity.id] = entity
+            if record.get('offset'):
+                crawl['offset'] = record['offset']
+                crawl['listed'] = record['listed']
+        elif 'crawled' in record:
+            self.crawls[record['crawled']]['done'] = True
+        elif 'link' in record:
+            self.links[record['link']] = Entity(**record['entity'])
+        elif 'username' in record:
+            self.usernames[record['username']] = Entity(**record['entity'])
+
+    def start_crawl(self, account, started_at):
+        self.write({'crawl': account, 'started_at': started_at})
+
+    def add_dialog(self, account, entity, listed=0, offset=None):
+        """Record a crawled dialog; offset is the position to continue listing from"""
+        record = {'dialog': account, 'entity': entity.to_dict()}
+        if offset:
+            record['offset'] = offset
+            record['listed'] = listed
+        self.write(record)
+
+    def finish_crawl(self, account):
+        self.write({'crawled': account})
+
+    def add_link(self, link, entity):
+        self.links[link] = entity
+        self.write({'link': link, 'entity': entity.to_dict()})
+
+    def add_username(self, username, entity):
+        self.usernames[username] = entity
+        self.write({'username': username, 'entity': entity.to_dict()})
+
+    def write(self, record):
+        self.pending.append(json.dumps(record, ensure_ascii=False))
+        if time.monotonic() - self.flushed_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            if self.file is None:
+                self.file = open(self.path, self.mode, encoding='utf-8')
+            self.file.write('\n'.join(self.pending) + '\n')
+            self.pending = []
+        if self.file is not None:
+            self.file.flush()
+        self.flushed_at = time.monotonic()
+
+    def close(self):
+        if self.file is None or not self.file.closed:
+            self.flush()
+        if self.file is not None:
+            self.file.close()
+
+    def remove(self):
+        """Delete the checkpoint once the run it tracks has completed"""
+        self.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+
+
+class DialogIndex:
+    """In-memory index of the account's dialogs, built from a single crawl.
+
+    Entities are keyed by id, by the hash of the chat's own invite link and by
+    the tokens of its description, so invite links can be matched without
+    walking every dialog again.
+
+    A compact index, used when results are streamed, keeps only each chat's
+    type, username and invite hashes (including those linked from its
+    description) instead of full records; its entities come back with just an
+    id and type.
+
+    Telegram only accepts a bare chat id from sessions that have seen the
+    chat, so the index also records which accounts of the pool crawled or
+    joined each chat. To stay free for a single account, chats only known to
+    account 0 are left out of that map.
+    """
+
+    def __init__(self, compact=False):
+        self.compact = compact
+        self.chats = {}
+        # chat id -> bitmask of account numbers, for chats seen by accounts other than 0
+        self.accounts = {}
+        self.by_invite_hash = {}
+        self.by_username = {}
+        self.by_token = {}
+
+    async def crawl(self, app, cache=None, metrics=None, checkpoint=None, account=0, on_dialog=None):
+        """Add the dialogs of an account to the index.
+
+        on_dialog, if given, is called with each entity as soon as it is
+        crawled, so results can be recorded or streamed during the crawl.
+
+        With a cache, the crawl stops at the first unpinned dialog whose top
+        message is unchanged since the last run: every dialog after it is older,
+        so the rest is served from the cache.
+
+        With a checkpoint, every dialog is journaled under the account number,
+        and a crawl the checkpoint already holds is continued from where it
+        stopped instead of starting over.
+        """
+        index = self
+        full_crawl = cache is None or cache.needs_full_crawl()
+        # Only top message ids are loaded up front; cached entities are read when needed
+        cached = {} if full_crawl else cache.load_top_messages()
+        started_at = time.time()
+        offset = None
+        crawled = 0
+
+        resumed = checkpoint.crawls.get(account) if checkpoint else None
+        if resumed:
+            for entity in resumed['entities'].values():
+                index.add(entity, account)
+                cached.pop(entity.id, None)
+                if on_dialog:
+                    on_dialog(entity)
+            if resumed['done']:
+                return
+            logger.info(f"Resuming the dialog crawl after {len(resumed['entities'])} dialogs")
+            started_at, offset, crawled = resumed['started_at'], resumed['offset'], resumed['listed']
+        elif checkpoint:
+            checkpoint.start_crawl(account, started_at)
+
+        async for dialog in list_dialogs(app, offset, skip=crawled):
+            chat = dialog.chat
+            if metrics:
+                # Pyrogram fetches dialogs in pages of 100
+                if crawled % 100 == 0:
+                    metrics.count_call('get_dialogs')
+                metrics.increment('dialogs')
+            crawled += 1
+            top_message = getattr(dialog, 'top_message', None)
+            top_message_id = top_message.id if top_message else None
+            top_message_date = top_message.date.timestamp() if top_message and top_message.date else None
+
+            pinned = getattr(dialog, 'is_pinned', False)
+            previous = cached.pop(chat.id, None)
+            if not full_crawl and top_message_id is not None and previous == top_message_id and not pinned:
+                entity = index.add(cache.get_entity(chat.id), account)
+                if checkpoint:
+                    checkpoint.add_dialog(account, entity)
+                if on_dialog:
+                    on_dialog(entity)
+                break
+
+            entity = index.add(chat, account)
+            if checkpoint:
+                # Pinned dialogs come first whatever their age, so paging from one would skip
+                # newer unpinned dialogs; a resume continues from the last unpinned position
+                position = [top_message_id, top_message_date, chat.id] \
+                    if top_message_id is not None and not pinned else None
+                checkpoint.add_dialog(account, entity, crawled, position)
+            if cache:
+                cache.record('dialogs', False)
+                cache.save_entity(entity, top_message_id, top_message_date)
+            if on_dialog:
+                on_dialog(entity)
+        else:
+            if cache:
+                cache.finish_full_crawl(started_at)
+            if checkpoint:
+                checkpoint.finish_crawl(account)
+            return
+
+        # Stopped early: everything older comes from the cache
+        cache.record('dialogs', True)
+        for entity in cache.iter_entities(cached):
+            cache.record('dialogs', True)
+            index.add(entity, account)
+            if checkpoint:
+                checkpoint.add_dialog(account, entity)
+            if on_dialog:
+                on_dialog(entity)
+        if checkpoint:
+            checkpoint.finish_crawl(account)
+
+    def add(self, chat, account=0):
+        """Add or replace a chat seen by an account number in the index and return its entity"""
+        entity = chat if isinstance(chat, Entity) else Entity.from_chat(chat)
+        self.seen_by(entity.id, account)
+        # Types are interned so a compact index shares one string per type
+        self.chats[entity.id] = sys.intern(entity.type) if self.compact else entity
+        if entity.username:
+            self.by_username[entity.username.lower()] = entity.id
+
+        # The chat's own link, and for entities the link they were resolved from
+        for link in (entity.chat_invite_link, entity.invite_link):
+            invite_hash = invite_hash_from_link(link)
+            if invite_hash:
+                self.by_invite_hash.setdefault(invite_hash, entity.id)
+
+        if entity.description and self.compact:
+            for invite_hash in INVITE_LINK_RE.findall(entity.description):
+                self.by_invite_hash.setdefault(invite_hash, entity.id)
+        elif entity.description:
+            for token in TOKEN_RE.findall(entity.description):
+                # A dict keeps the first chat first and makes repeats free
+                self.by_token.setdefault(token, {}).setdefault(entity.id)
+        return entity
+
+    def get(self, chat_id):
+        entry = self.chats.get(chat_id)
+        if self.compact and entry is not None:
+            return Entity(id=chat_id, type=entry)
+        return entry
+
+    def find_by_username(self, username):
+        return self.get(self.by_username.get(username.lower()))
+
+    def seen_by(self, chat_id, account):
+        """Record that an account number has seen a chat (before it is added, or again later)"""
+        if account:
+            known = 1 if chat_id in self.chats else 0
+            self.accounts[chat_id] = self.accounts.get(chat_id, known) | 1 << account
+
+    def accounts_of(self, chat_id):
+        """Return the numbers of the accounts that have seen a chat"""
+        mask = self.accounts.get(chat_id, 1)
+        return [number for number in range(mask.bit_length()) if mask >> number & 1]
+
+    def find_by_invite_hash(self, invite_hash):
+        """Return the first indexed entity whose invite link or description carries the hash"""
+        if not invite_hash:
+            return None
+        chat_id = self.by_invite_hash.get(invite_hash)
+        if chat_id is None:
+            chat_id = next(iter(self.by_token.get(invite_hash, ())), None)
+        return self.get(chat_id)
+
+    def __iter__(self):
+        if self.compact:
+            return (Entity(id=chat_id, type=chat_type) for chat_id, chat_type in self.chats.items())
+        return iter(self.chats.values())
+
+    def __len__(self):
+        return len(self.chats)
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """Logs to stdout, replacing characters (e.g. emojis) the console cannot encode"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+        self.setFormatter(logging.Formatter('%(message)s'))
+
+    def format(self, record):
+        message = super().format(record)
+        encoding = getattr(self.stream, 'encoding', None) or 'utf-8'
+        return message.encode(encoding, 'replace').decode(encoding)
+
+
+def configure_logging(quiet=False):
+    """Send progress messages to the console; in quiet mode only warnings and errors"""
+    logger.addHandler(ConsoleHandler())
+    logger.setLevel(logging.WARNING if quiet else logging.INFO)
+
+
+class Metrics:
+    """Timings and counters for one run.
+
+    Phases are timed with `with metrics.phase('dialog_crawl'):` and single
+    operations (one invite link, one join) with observe(). API calls are
+    counted by method as they go through the accounts, and FLOOD_WAIT time
+    is read from the registered schedulers.
+    """
 
-class TelegramIDFetcher:
     def __init__(self):
-        self.results = {
-            'channels': [],
-            'groups': [],
-            'bots': [],
-            'usernames': [],
-            'invite_links': []  # Category for invite links
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.operations = {}  # name -> [count, total seconds, max seconds]
+        self.api_calls = {}
+        self.counters = {}
+        self.schedulers = []
+        self.store = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def observe(self, name, seconds):
+        stats = self.operations.setdefault(name, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    def count_call(self, method):
+        self.api_calls[method] = self.api_calls.get(method, 0) + 1
+
+    def increment(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def flood_wait_time(self):
+        return sum(scheduler.flood_wait_time for scheduler in self.schedulers)
+
+    @property
+    def entities(self):
+        return len(self.store) if self.store is not None else 0
+
+    def to_dict(self):
+        elapsed = self.elapsed
+        return {
+            'elapsed_seconds': round(elapsed, 3),
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'operations': {
+                name: {
+                    'count': count,
+                    'total_seconds': round(total, 3),
+                    'avg_seconds': round(total / count, 4) if count else 0,
+                    'max_seconds': round(longest, 3),
+                }
+                for name, (count, total, longest) in self.operations.items()
+            },
+            'api_calls': dict(self.api_calls),
+            'flood_wait_seconds': round(self.flood_wait_time, 3),
+            'counters': dict(self.counters),
+            'entities': self.entities,
+            'entities_per_second': round(self.entities / elapsed, 2) if elapsed else 0,
         }
 
-    async def fetch_with_pyrogram(self, invite_links=None):
+    def to_prometheus(self):
+        data = self.to_dict()
+        lines = []
+        for name in ('elapsed_seconds', 'flood_wait_seconds', 'entities', 'entities_per_second'):
+            lines += [f"# TYPE telegram_ids_{name} gauge", f"telegram_ids_{name} {data[name]}"]
+        if data['phases']:
+            lines.append("# TYPE telegram_ids_phase_seconds gauge")
+        lines += [f'telegram_ids_phase_seconds{{phase="{name}"}} {value}' for name, value in data['phases'].items()]
+        if data['api_calls']:
+            lines.append("# TYPE telegram_ids_api_calls_total counter")
+        lines += [f'telegram_ids_api_calls_total{{method="{name}"}} {value}' for name, value in data['api_calls'].items()]
+        for name, value in data['counters'].items():
+            # Counters such as 'invite_links_total' already carry the suffix
+            name = re.sub(r'_total$', '', name)
+            lines += [f"# TYPE telegram_ids_{name}_total counter", f"telegram_ids_{name}_total {value}"]
+        if data['operations']:
+            lines.append("# TYPE telegram_ids_operation_seconds summary")
+        for name, stats in data['operations'].items():
+            lines.append(f'telegram_ids_operation_seconds_count{{operation="{name}"}} {stats["count"]}')
+            lines.append(f'telegram_ids_operation_seconds_sum{{operation="{name}"}} {stats["total_seconds"]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics as Prometheus text (.prom/.txt) or JSON (anything else)"""
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith(('.prom', '.txt')):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=4)
+
+    def progress_line(self):
+        counters = self.counters
+        parts = [f"[{self.elapsed:7.1f}s] {counters.get('dialogs', 0)} dialogs"]
+        if counters.get('enrich_total'):
+            parts.append(f"{counters.get('enrich_done', 0)}/{counters['enrich_total']} enriched")
+        if counters.get('invite_links_total'):
+            parts.append(f"{counters.get('invite_links_done', 0)}/{counters['invite_links_total']} invite links")
+        if counters.get('usernames_total'):
+            parts.append(f"{counters.get('usernames_done', 0)}/{counters['usernames_total']} usernames")
+        parts.append(f"{sum(self.api_calls.values())} API calls")
+        parts.append(f"{self.flood_wait_time:.0f}s FLOOD_WAIT")
+        parts.append(f"{self.entities / self.elapsed if self.elapsed else 0:.1f} entities/s")
+        return ", ".join(parts)
+
+    async def report_progress(self, interval):
+        """Print a progress line every interval seconds until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            print(self.progress_line(), flush=True)
+
+
+def flood_wait_seconds(error):
+    """Return the wait Telegram asked for if error is a FLOOD_WAIT, else None"""
+    value = getattr(error, 'value', None)
+    if 'FLOOD_WAIT' in str(error) and isinstance(value, (int, float)):
+        return value
+    return None
+
+
+class RateScheduler:
+    """Central scheduler for Telegram API calls.
+
+    Every call goes through call() under a method class (e.g. 'join_chat').
+    When Telegram answers with FLOOD_WAIT only that method class is paused for
+    the requested time, then the call is retried with exponential backoff.
+    """
+
+    def __init__(self, max_retries=3, backoff=1.0, max_wait=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.paused_until = {}
+        self.flood_wait_time = 0.0
+
+    async def wait(self, method):
+        """Sleep until the method class is no longer paused"""
+        loop = asyncio.get_running_loop()
+        while True:
+            remaining = self.paused_until.get(method, 0) - loop.time()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(remaining)
+
+    def pause(self, method, seconds):
+        """Pause a method class for the given number of seconds"""
+        now = asyncio.get_running_loop().time()
+        paused_until = max(self.paused_until.get(method, 0), now)
+        deadline = now + seconds
+        if deadline > paused_until:
+            # Overlapping pauses only count the time they add
+            self.flood_wait_time += deadline - paused_until
+            self.paused_until[method] = deadline
+
+    async def call(self, method, func, *args, **kwargs):
+        """Run func(*args, **kwargs), retrying FLOOD_WAIT and network errors"""
+        attempt = 0
+        while True:
+            await self.wait(method)
+            try:
+                return await func(*args, **kwargs)
+            except (OSError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logger.warning(f"Network error on {method} ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                wait = flood_wait_seconds(e)
+                if wait is None or attempt >= self.max_retries:
+                    raise
+                if self.max_wait is not None and wait > self.max_wait:
+                    raise
+                delay = wait + self.backoff * 2 ** attempt
+                logger.warning(f"FLOOD_WAIT on {method}: pausing it for {delay:.1f}s")
+                self.pause(method, delay)
+            attempt += 1
+
+
+class Account:
+    """One Telegram session of the account pool, with its own rate accounting"""
+
+    def __init__(self, name, app, scheduler, metrics=None, number=0):
+        self.name = name
+        self.number = number  # position in the pool, as recorded by the dialog index
+        self.app = app
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.calls = {}
+        self.inflight = 0
+        self.barred = False  # no longer used for joins (banned, chat limit reached...)
+        self.dead = False  # no longer used at all (session revoked, account deleted...)
+
+    async def call(self, method, func, *args, **kwargs):
+        """Run an API call through this account's scheduler"""
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.metrics:
+            self.metrics.count_call(method)
+        self.inflight += 1
+        try:
+            return await self.scheduler.call(method, func, *args, **kwargs)
+        finally:
+            self.inflight -= 1
+
+
+class AccountPool:
+    """Shards API calls across several accounts.
+
+    Each call goes to the available account that is least paused and least
+    busy. When an account hits a long FLOOD_WAIT or an account-level error
+    (banned, too many channels...), the call fails over to the next account;
+    accounts whose session is gone (revoked, deactivated) are dropped for
+    every method.
+    """
+
+    def __init__(self, accounts):
+        self.accounts = accounts
+
+    @property
+    def primary(self):
+        return self.accounts[0]
+
+    def pick(self, method, exclude=(), among=None):
+        """Return the best account for a method, or None if all are excluded, dead or barred"""
+        candidates = [
+            account for account in (self.accounts if among is None else among)
+            if account not in exclude and not account.dead
+            and not (method == 'join_chat' and account.barred)
+        ]
+        if not candidates:
+            return None
+        now = asyncio.get_running_loop().time()
+        return min(candidates, key=lambda account: (
+            max(0, account.scheduler.paused_until.get(method, 0) - now), account.inflight
+        ))
+
+    def failover(self, account, method, error):
+        """Take an account out of rotation for an error; return False if the error is not account-specific"""
+        wait = flood_wait_seconds(error)
+        if wait is not None:
+            account.scheduler.pause(method, wait)
+            logger.warning(f"Account {account.name} is flood-limited on {method} for {wait}s, trying another account")
+        elif any(code in str(error) for code in ACCOUNT_DEAD_ERRORS):
+            account.dead = True
+            logger.warning(f"Account {account.name} can no longer be used ({error}), trying another account")
+        elif any(code in str(error) for code in ACCOUNT_LIMIT_ERRORS):
+            account.barred = True
+            logger.warning(f"Account {account.name} can no longer join chats ({error}), trying another account")
+        else:
+            return False
+        return True
+
+    async def call(self, method, func_name, *args, among=None, **kwargs):
+        """Call a client method on the best available account and return (account, result).
+
+        `among` limits the call to some of the accounts, e.g. those whose
+        sessions know a chat id. Errors that are not account-specific are
+        raised with the account that hit them attached as `error.account`.
+        """
+        tried = []
+        last_error = None
+        rounds = 0
+        while True:
+            account = self.pick(method, exclude=tried, among=among)
+            if account is None:
+                # Every account has been tried: wait out the shortest pause once more
+                rounds += 1
+                if last_error is None or rounds > 2 or self.pick(method, among=among) is None:
+                    raise last_error or RuntimeError(f"No account available for {method}")
+                tried = []
+                continue
+            tried.append(account)
+            try:
+                return account, await account.call(method, getattr(account.app, func_name), *args, **kwargs)
+            except Exception as e:
+                if not self.failover(account, method, e):
+                    e.account = account
+                    raise
+                last_error = e
+
+    def report(self):
+        logger.info("\nAccounts:")
+        for account in self.accounts:
+            calls = ", ".join(f"{method}: {count}" for method, count in account.calls.items()) or "no calls"
+            status = " (unusable)" if account.dead else " (barred from joining)" if account.barred else ""
+            logger.info(f"  {account.name}: {calls}; {account.scheduler.flood_wait_time:.1f}s FLOOD_WAIT{status}")
+
+
+class InviteResolver:
+    """Finds the chat behind an invite link an account is already a member of.
+
+    The fetcher looks the hash up in the dialog index and then tries to join;
+    this resolver only runs once joining reports that the account is already
+    a member. Its paths, cheapest first:
+    - invite_check: get_chat(link), which checks the invite and returns the
+      chat directly when the account is a member
+    - history_scan: opt-in, the hash in recent messages of the indexed dialogs,
+      limited to history_budget get_chat_history calls per link
+    API calls and successful resolutions are counted per path.
+    """
+
+    PATHS = ('invite_check', 'history_scan')
+
+    def __init__(self, index, history_budget=0):
+        self.index = index
+        self.history_budget = history_budget
+        self.calls = {path: 0 for path in self.PATHS}
+        self.resolved = {path: 0 for path in self.PATHS}
+
+    async def resolve(self, account, link, invite_hash):
+        """Return (entity, path) for the link, or (None, None) if it could not be resolved"""
+        for path in self.PATHS:
+            entity = await getattr(self, path)(account, link, invite_hash)
+            if entity:
+                self.resolved[path] += 1
+                return entity, path
+        return None, None
+
+    async def invite_check(self, account, link, invite_hash):
+        self.calls['invite_check'] += 1
+        try:
+            chat = await account.call('get_chat', account.app.get_chat, link)
+        except Exception:
+            return None
+        # Non-members only get a ChatPreview, which carries no id
+        if getattr(chat, 'id', None) is None:
+            return None
+        entity = self.index.get(chat.id)
+        if entity is None:
+            return self.index.add(chat, account.number)
+        # Enrichment may have to look the chat up through this account
+        self.index.seen_by(chat.id, account.number)
+        return entity
+
+    async def history_scan(self, account, link, invite_hash):
+        if not invite_hash:
+            return None
+        for entity in itertools.islice(self.index, self.history_budget):
+            self.calls['history_scan'] += 1
+            try:
+                texts = await account.call('get_chat_history', recent_message_texts, account.app, entity.id)
+            except Exception:
+                continue
+            if any(invite_hash in TOKEN_RE.findall(text) for text in texts):
+                return entity
+        return None
+
+    def report(self):
+        logger.info("\nInvite link resolution (resolved / API calls):")
+        for path in self.PATHS:
+            logger.info(f"  {path}: {self.resolved[path]} / {self.calls[path]}")
+
+
+def load_session_strings():
+    """Return the session strings configured in the environment.
+
+    SESSION_STRING, SESSION_STRING_1, SESSION_STRING_2, ... and the lines of
+    the file named by SESSIONS_FILE are all used, without duplicates.
+    """
+    sessions = []
+    if os.getenv("SESSION_STRING"):
+        sessions.append(os.getenv("SESSION_STRING"))
+    number = 1
+    while os.getenv(f"SESSION_STRING_{number}"):
+        sessions.append(os.getenv(f"SESSION_STRING_{number}"))
+        number += 1
+    if os.getenv("SESSIONS_FILE"):
+        with open(os.getenv("SESSIONS_FILE"), encoding='utf-8') as f:
+            sessions.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return list(dict.fromkeys(sessions))
+
+
+def create_clients():
+    """Create one Pyrogram client per configured session, or [] if credentials are missing"""
+    # Imported here so offline commands such as query never load Pyrogram
+    from dotenv import load_dotenv
+    from pyrogram import Client
+
+    # Load environment variables
+    load_dotenv()
+
+    # Get credentials from environment variables
+    API_ID = os.getenv("API_ID")
+    API_HASH = os.getenv("API_HASH")
+    SESSION_STRINGS = load_session_strings()
+
+    # Check if credentials are available
+    if not all([API_ID, API_HASH, SESSION_STRINGS]):
+        logger.error("Error: Missing Telegram API credentials in .env file")
+        logger.error("Please create a .env file with API_ID, API_HASH, and SESSION_STRING")
+        return []
+
+    return [
+        Client(
+            name=f"user{number}" if number else "user",
+            api_id=API_ID,
+            api_hash=API_HASH,
+            session_string=session_string,
+            in_memory=True
+        )
+        for number, session_string in enumerate(SESSION_STRINGS)
+    ]
+
+
+async def connect_clients(clients):
+    """Start the clients, skipping accounts that fail to connect; return the connected ones"""
+    connected = []
+    for app in clients:
+        try:
+            await app.start()
+            connected.append(app)
+        except Exception as e:
+            logger.warning(f"Error connecting account {app.name}: {e}")
+    return connected
+
+
+class TelegramIDFetcher:
+    """Fetches the IDs of everything a Telegram account has access to.
+
+    Besides the one-shot fetch_with_pyrogram() used by the command line, the
+    fetcher can be used as a library that keeps its clients connected:
+
+        async with TelegramIDFetcher() as fetcher:
+            entity = await fetcher.resolve("https://t.me/+hash")
+            async for entity in fetcher.iter_dialogs():
+                ...
+            results = await fetcher.snapshot()
+
+    With several sessions configured, lookups and joins are sharded across
+    the accounts. Clients passed in via `client` (one or a list) must already
+    be connected; they are not started or stopped by the fetcher. With a
+    checkpoint, progress is journaled and work it already holds is skipped.
+
+    The dialog crawl only collects what get_dialogs() returns (id, type,
+    title, username). `enrich` selects dialogs, by category name, 'all' or
+    chat id, whose full details are then fetched with get_chat().
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, scheduler=None, cache=None, writer=None,
+                 history_budget=0, client=None, metrics=None, checkpoint=None, enrich=()):
+        self.results = EntityStore(writer)
+        self.metrics = metrics or Metrics()
+        self.metrics.store = self.results
+        self.history_budget = history_budget
+        self.resolver = None
+        self.concurrency = max(1, concurrency)
+        self.scheduler = scheduler or RateScheduler()
+        self.cache = cache
+        self.checkpoint = checkpoint
+        self.enrich_selectors = list(enrich)
+        self.clients = [] if client is None else client if isinstance(client, list) else [client]
+        self.pool = None
+        self.index = None
+        self.owns_clients = False
+        self.inflight = {}
+        self.started = False
+        # Concurrent first resolve() calls must connect and crawl only once
+        self.start_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def start(self):
+        """Connect (creating clients from .env if none were given) and index the dialogs"""
+        async with self.start_lock:
+            if self.started:
+                return
+            if not self.clients:
+                clients = create_clients()
+                if not clients:
+                    raise RuntimeError("Missing Telegram API credentials in .env file")
+                logger.info("Connecting to Telegram... (this may take a moment)")
+                with self.metrics.phase('connect'):
+                    self.clients = await connect_clients(clients)
+                if not self.clients:
+                    raise RuntimeError("Could not connect any Telegram account")
+                self.owns_clients = True
+            await self.load_dialogs(self.clients)
+            if self.enrich_selectors:
+                with self.metrics.phase('enrich'):
+                    await self.enrich_dialogs(self.index, self.enrich_selectors)
+            self.started = True
+
+    async def stop(self):
+        """Disconnect the clients if the fetcher created them"""
+        if self.owns_clients:
+            for app in self.clients:
+                await app.stop()
+            self.clients = []
+            self.owns_clients = False
+        self.index = None
+        self.resolver = None
+        self.started = False
+
+    def make_pool(self, clients):
+        """Wrap the clients in an account pool with one scheduler per account"""
+        if len(clients) == 1:
+            pool = AccountPool([Account("user", clients[0], self.scheduler, self.metrics)])
+        else:
+            # Long flood waits fail over to another account instead of blocking
+            pool = AccountPool([
+                Account(f"user{number}", app, RateScheduler(
+                    max_retries=self.scheduler.max_retries,
+                    backoff=self.scheduler.backoff,
+                    max_wait=FAILOVER_FLOOD_WAIT,
+                ), self.metrics, number)
+                for number, app in enumerate(clients)
+            ])
+        self.metrics.schedulers = [account.scheduler for account in pool.accounts]
+        return pool
+
+    async def load_dialogs(self, clients):
+        """Crawl the dialogs of every account once into a shared index"""
+        self.pool = self.make_pool(clients)
+        self.resolver = None
+        # Kept while crawling, so an interrupted run can still save what it found.
+        # Streamed dialogs are written as they are crawled; the index keeps only lookup keys
+        self.index = DialogIndex(compact=self.results.writer is not None)
+        with self.metrics.phase('dialog_crawl'):
+            await self.index.crawl(self.pool.primary.app, self.cache, self.metrics, self.checkpoint,
+                                   on_dialog=self.add_dialog_result)
+            # The cache tracks the primary account's dialogs; other accounts are crawled in full
+            await asyncio.gather(*(
+                self.index.crawl(account.app, metrics=self.metrics, checkpoint=self.checkpoint, account=number,
+                                 on_dialog=self.add_dialog_result)
+                for number, account in enumerate(self.pool.accounts[1:], 1)
+            ))
+        logger.info(f"Indexed {len(self.index)} dialogs")
+        self.resolver = InviteResolver(self.index, self.history_budget)
+        return self.index
+
+    async def resolve(self, target):
+        """Resolve an invite link or username to an Entity, or None if it cannot be found.
+
+        Concurrent calls for the same target share a single lookup.
+        """
+        normalized = normalize_target(target)
+        if normalized is None:
+            raise ValueError(f"Not an invite link or username: {target}")
+        kind, value = normalized
+        key = (kind, value.lower() if kind == 'username' else value)
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.resolve_target(kind, value))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def resolve_target(self, kind, value):
+        await self.start()
+        if kind == 'invite_link':
+            entity = await self.resolve_invite_link(self.index, value)
+            if entity:
+                self.add_invite_result(entity, value)
+            return entity
+
+        entity = self.index.find_by_username(value)
+        if entity is None:
+            entity = await self.lookup_username(self.index, value)
+        if entity:
+            self.add_username_result(value, entity)
+        return entity
+
+    async def iter_dialogs(self):
+        """Yield the entity of every dialog of the account"""
+        await self.start()
+        for entity in list(self.index):
+            yield entity
+
+    async def enrich(self, *selectors):
+        """Fetch full details for the dialogs matching the selectors; return their entities"""
+        await self.start()
+        return await self.enrich_dialogs(self.index, selectors)
+
+    async def snapshot(self):
+        """Return the categorized results, including every dialog"""
+        await self.start()
+        self.categorize_dialogs(self.index)
+        return self.results.to_dict()
+
+    def add_invite_result(self, entity, link):
+        """Record an entity resolved from an invite link"""
+        if not entity.invite_link:
+            entity.invite_link = link
+        entity = self.results.add(entity)
+        if self.checkpoint and link not in self.checkpoint.links:
+            self.checkpoint.add_link(link, entity)
+        if entity.category:
+            logger.info(f"Categorized as: {CATEGORY_LABELS[entity.category].capitalize()}")
+
+    async def fetch_with_pyrogram(self, invite_links=None, usernames=None):
         """Fetch IDs using Pyrogram"""
-        # Load environment variables
-        load_dotenv()
-        
-        # Get credentials from environment variables
-        API_ID = os.getenv("API_ID")
-        API_HASH = os.getenv("API_HASH")
-        SESSION_STRING = os.getenv("SESSION_STRING")
-        
-        # Check if credentials are available
-        if not all([API_ID, API_HASH, SESSION_STRING]):
-            print("Error: Missing Telegram API credentials in .env file")
-            print("Please create a .env file with API_ID, API_HASH, and SESSION_STRING")
+        clients = create_clients()
+        if not clients:
             return False
     
         try:
-            print("Connecting to Telegram... (this may take a moment)")
-            sys.stdout.flush()  # Force output to be displayed immediately
-            
-            async with Client(
-                name="user",
-                api_id=API_ID,
-                api_hash=API_HASH,
-                session_string=SESSION_STRING,
-                in_memory=True
-            ) as app:
-                print("Connected! Fetching dialogs...")
-                sys.stdout.flush()
-                
-                # Process invite links if provided
-                if invite_links and len(invite_links) > 0:
-                    print(f"\nProcessing {len(invite_links)} invite links...")
-                    sys.stdout.flush()
-                    
-                    for link in invite_links:
-                        try:
-                            print(f"\nProcessing invite link: {link}")
-                            sys.stdout.flush()
-                            
-                            # Try to get chat info
-                            try:
-                                # Extract the invite hash from the link
-                                invite_hash = None
-                                if '+' in link:
-                                    invite_hash = link.split('+')[1]
-                                elif 'joinchat/' in link:
-                                    invite_hash = link.split('joinchat/')[1]
-                                
-                                # Try to find the chat in existing dialogs
-                                print("Checking if already a member...")
-                                sys.stdout.flush()
-                                
-                                found_in_dialogs = False
-                                async for dialog in app.get_dialogs():
-                                    chat = dialog.chat
-                                    # If we find a matching invite link in chat description or title
-                                    if (hasattr(chat, 'invite_link') and chat.invite_link and invite_hash in chat.invite_link) or \
-                                       (hasattr(chat, 'description') and chat.description and invite_hash in chat.description):
-                                        found_in_dialogs = True
-                                        info = {
-                                            'title': chat.title or chat.first_name or chat.username or "Unknown",
-                                            'username': chat.username if hasattr(chat, 'username') else None,
-                                            'id': chat.id,
-                                            'type': str(chat.type),
-                                            'description': chat.description if hasattr(chat, 'description') else None,
-                                            'invite_link': link
-                                        }
-                                        print(f"Found in existing dialogs: {info['title']} (Type: {chat.type})")
-                                        sys.stdout.flush()
-                                        
-                                        # Add to invite_links category
-                                        self.results['invite_links'].append(info)
-                                        
-                                        # Also categorize based on chat type
-                                        if chat.type == enums.ChatType.CHANNEL:
-                                            self.results['channels'].append(info)
-                                            print("Categorized as: Channel")
-                                        elif chat.type in [enums.ChatType.GROUP, enums.ChatType.SUPERGROUP]:
-                                            self.results['groups'].append(info)
-                                            print("Categorized as: Group")
-                                        break
-                                
-                                if not found_in_dialogs:
-                                    # If not found in dialogs, try to join
-                                    print("Not found in existing dialogs. Attempting to join chat...")
-                                    sys.stdout.flush()
-                                    try:
-                                        chat = await app.join_chat(link)
-                                        
-                                        info = {
-                                            'title': chat.title or chat.first_name or chat.username or "Unknown",
-                                            'username': chat.username if hasattr(chat, 'username') else None,
-                                            'id': chat.id,
-                                            'type': str(chat.type),
-                                            'description': chat.description if hasattr(chat, 'description') else None,
-                                            'invite_link': link
-                                        }
-                                        
-                                        print(f"Successfully joined: {info['title']} (Type: {chat.type})")
-                                        sys.stdout.flush()
-                                        
-                                        # Add to invite_links category
-                                        self.results['invite_links'].append(info)
-                                        
-                                        # Also categorize based on chat type
-                                        if chat.type == enums.ChatType.CHANNEL:
-                                            self.results['channels'].append(info)
-                                            print("Categorized as: Channel")
-                                        elif chat.type in [enums.ChatType.GROUP, enums.ChatType.SUPERGROUP]:
-                                            self.results['groups'].append(info)
-                                            print("Categorized as: Group")
-                                    except Exception as e:
-                                        # Check if the error is because we're already a member
-                                        if "USER_ALREADY_PARTICIPANT" in str(e):
-                                            print("Already a member of this chat. Trying to get chat info directly...")
-                                            sys.stdout.flush()
-                                            
-                                            # Try to get the chat info from the invite hash
-                                            try:
-                                                # For private groups, we need to use get_chat_history to get a message first
-                                                # Then extract the chat from the message
-                                                async for dialog in app.get_dialogs():
-                                                    chat = dialog.chat
-                                                    # Check if this might be our chat by checking recent messages
-                                                    try:
-                                                        async for message in app.get_chat_history(chat.id, limit=5):
-                                                            # If we find a message with our invite link
-                                                            if hasattr(message, 'text') and message.text and invite_hash in message.text:
-                                                                info = {
-                                                                    'title': chat.title or chat.first_name or chat.username or "Unknown",
-                                                                    'username': chat.username if hasattr(chat, 'username') else None,
-                                                                    'id': chat.id,
-                                                                    'type': str(chat.type),
-                                                                    'description': chat.description if hasattr(chat, 'description') else None,
-                                                                    'invite_link': link
-                                                                }
-                                                                
-                                                                print(f"Found chat through messages: {info['title']} (Type: {chat.type})")
-                                                                sys.stdout.flush()
-                                                                
-                                                                # Add to invite_links category
-                                                                self.results['invite_links'].append(info)
-                                                                
-                                                                # Also categorize based on chat type
-                                                                if chat.type == enums.ChatType.CHANNEL:
-                                                                    self.results['channels'].append(info)
-                                                                    print("Categorized as: Channel")
-                                                                elif chat.type in [enums.ChatType.GROUP, enums.ChatType.SUPERGROUP]:
-                                                                    self.results['groups'].append(info)
-                                                                    print("Categorized as: Group")
-                                                                found_in_dialogs = True
-                                                                break
-                                                        if found_in_dialogs:
-                                                            break
-                                                    except Exception:
-                                                        continue
-                                            except Exception as e2:
-                                                print(f"Error getting chat info: {str(e2)}")
-                                                sys.stdout.flush()
-                                        else:
-                                            # If it's a different error, re-raise it
-                                            raise e
-                            
-                            except Exception as e:
-                                print(f"Error processing invite link {link}: {str(e)}")
-                                sys.stdout.flush()
-                                continue
-                                
-                        except Exception as e:
-                            print(f"Error processing invite link {link}: {str(e)}")
-                            sys.stdout.flush()
-                            continue
-
-                # Remove the hardcoded list of usernames section
-                # The following section should be removed:
-                # target_usernames = [
-                #     "memumssun",
-                #     "DebitKard0",
-                #     "PandorasTrap",
-                #     "RaFORWARDBot",
-                #     "RaSCRAPEBot",
-                #     "RaSCRAPERChat",
-                #     "RaSCRAPER",
-                #     "PharaohScraper",
-                #     "PharaohScraperChat"
-                # ]
-                # 
-                # print(f"\nSearching for {len(target_usernames)} specific usernames...")
-                # for username in target_usernames:
-                #     try:
-                #         print(f"\nLooking up @{username}")
-                #         chat = await app.get_chat(username)
-                #         
-                #         info = {
-                #             'title': chat.title or chat.first_name or chat.username,
-                #             'username': chat.username,
-                #             'id': chat.id,
-                #             'type': str(chat.type),
-                #             'description': chat.description if hasattr(chat, 'description') else None
-                #         }
-                #         
-                #         print(f"Found: {info['title']} (Type: {chat.type})")
-                #         
-                #         # Properly categorize based on chat type
-                #         if chat.type == enums.ChatType.CHANNEL:
-                #             self.results['channels'].append(info)
-                #             print("Categorized as: Channel")
-                #         elif chat.type in [enums.ChatType.GROUP, enums.ChatType.SUPERGROUP]:
-                #             self.results['groups'].append(info)
-                #             print("Categorized as: Group")
-                #         elif chat.type == enums.ChatType.BOT:
-                #             self.results['bots'].append(info)
-                #             print("Categorized as: Bot")
-                #         elif chat.type == enums.ChatType.PRIVATE:
-                #             self.results['usernames'].append(info)
-                #             print("Categorized as: User")
-                #             
-                #     except Exception as e:
-                #         print(f"Error looking up @{username}: {str(e)}")
-                #         continue
-                #
-                # Remove the hardcoded list of usernames
-                # Instead, just fetch all dialogs the user has access to
-                
-                print("\nFetching all dialogs...")
-                async for dialog in app.get_dialogs():
-                    try:
-                        chat = dialog.chat
-                        # Skip if we already have this chat by ID
-                        if any(item.get('id') == chat.id for items in self.results.values() for item in items):
-                            continue
-                            
-                        info = {
-                            'title': chat.title or chat.first_name or chat.username or "Unknown",
-                            'username': chat.username if hasattr(chat, 'username') else None,
-                            'id': chat.id,
-                            'type': str(chat.type),
-                            'description': chat.description if hasattr(chat, 'description') else None
-                        }
-                        
-                        if chat.type == enums.ChatType.CHANNEL:
-                            self.results['channels'].append(info)
-                            print(f"Found channel: {info['title']}")
-                        elif chat.type in [enums.ChatType.GROUP, enums.ChatType.SUPERGROUP]:
-                            self.results['groups'].append(info)
-                            print(f"Found group: {info['title']}")
-                        elif chat.type == enums.ChatType.BOT:
-                            self.results['bots'].append(info)
-                            print(f"Found bot: {info['title']}")
-                        elif chat.type == enums.ChatType.PRIVATE:
-                            self.results['usernames'].append(info)
-                            print(f"Found user: {info['title']}")
-                    except Exception as e:
-                        print(f"Error processing dialog: {e}")
-                        continue
+            logger.info(f"Connecting to Telegram with {len(clients)} account(s)... (this may take a moment)")
+
+            with self.metrics.phase('connect'):
+                clients = await connect_clients(clients)
+            if not clients:
+                return False
+            try:
+                await self.fetch_with_clients(clients, invite_links, usernames)
+            finally:
+                for app in clients:
+                    await app.stop()
                         
         except Exception as e:
-            print(f"Error connecting to Telegram: {e}")
+            logger.error(f"Error connecting to Telegram: {e}")
             return False
         return True
 
+    async def fetch_with_client(self, app, invite_links=None, usernames=None):
+        """Fetch IDs using an already connected client"""
+        await self.fetch_with_clients([app], invite_links, usernames)
+
+    async def fetch_with_clients(self, clients, invite_links=None, usernames=None):
+        """Fetch IDs using already connected clients, one per account"""
+        logger.info("Connected! Fetching dialogs...")
+        index = await self.load_dialogs(clients)
+
+        # Links already saved by an interrupted streaming run are not resolved again
+        if invite_links and self.results.writer and self.results.writer.seen_links:
+            invite_links = [link for link in invite_links if link not in self.results.writer.seen_links]
+        if self.checkpoint:
+            self.restore_checkpoint(index)
+            invite_links = [link for link in invite_links or [] if link not in self.checkpoint.links]
+
+        # Before the links, so enriched descriptions and chat links can match them too
+        if self.enrich_selectors:
+            with self.metrics.phase('enrich'):
+                await self.enrich_dialogs(index, self.enrich_selectors)
+
+        # Process invite links if provided
+        if invite_links and len(invite_links) > 0:
+            self.metrics.increment('invite_links_total', len(invite_links))
+            logger.info(f"\nProcessing {len(invite_links)} invite links "
+                        f"({self.concurrency} at a time)...")
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            resolved = {}
+            next_to_record = 0
+
+            async def worker(position, link):
+                nonlocal next_to_record
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        resolved[position] = await self.resolve_invite_link(index, link)
+                    except Exception as e:
+                        logger.warning(f"Error processing invite link {link}: {str(e)}")
+                        resolved[position] = None
+                    self.metrics.observe('resolve', time.perf_counter() - start)
+                    self.metrics.increment('invite_links_done')
+
+                # Record results in input order as soon as all earlier links are done
+                while next_to_record in resolved:
+                    entity = resolved.pop(next_to_record)
+                    if entity is not None:
+                        self.add_invite_result(entity, invite_links[next_to_record])
+                    next_to_record += 1
+
+            with self.metrics.phase('invite_links'):
+                await asyncio.gather(*(worker(position, link) for position, link in enumerate(invite_links)))
+            self.resolver.report()
+
+        if usernames:
+            with self.metrics.phase('usernames'):
+                await self.resolve_usernames(index, usernames)
+
+        logger.info("\nCategorizing all dialogs...")
+        with self.metrics.phase('categorize'):
+            self.categorize_dialogs(index)
+
+        if self.cache:
+            self.cache.report()
+        if len(self.pool.accounts) > 1:
+            self.pool.report()
+
+    def restore_checkpoint(self, index):
+        """Record the invite links and usernames the checkpointed run already resolved"""
+        for link, entity in list(self.checkpoint.links.items()):
+            self.add_invite_result(index.get(entity.id) or index.add(entity), link)
+        # Restored usernames are then answered by the index without a lookup
+        for entity in self.checkpoint.usernames.values():
+            if index.get(entity.id) is None:
+                index.add(entity)
+
+    async def enrich_dialogs(self, index, selectors):
+        """Fill in full chat details for the selected dialogs, using the cache where it is fresh"""
+        categories = {selector for selector in selectors if isinstance(selector, str)}
+        ids = {selector for selector in selectors if not isinstance(selector, str)}
+        selected = [
+            entity for entity in index
+            if 'all' in categories or entity.category in categories or entity.id in ids
+        ]
+        self.metrics.increment('enrich_total', len(selected))
+
+        stale = []
+        for entity in selected:
+            details = self.cache.get_details(entity.id) if self.cache else None
+            if self.cache:
+                self.cache.record('details', details is not None)
+            if details is None:
+                stale.append(entity)
+                continue
+            entity.description, entity.members_count, entity.linked_chat_id, entity.chat_invite_link = details
+            index.add(entity)
+            self.results.update(entity, entity.details())
+            self.metrics.increment('enrich_done')
+        logger.info(f"\nEnriching {len(selected)} dialogs: {len(selected) - len(stale)} from cache, "
+                    f"{len(stale)} to fetch...")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_details(entity):
+            async with semaphore:
+                # Only sessions that have seen the chat can look it up by id
+                among = [self.pool.accounts[number] for number in index.accounts_of(entity.id)]
+                try:
+                    _, chat = await self.pool.call('get_chat', 'get_chat', entity.id, among=among)
+                except Exception as e:
+                    logger.warning(f"Error fetching details of {entity.title} ({entity.id}): {e}")
+                    return
+            entity.set_details(chat)
+            # Re-index so the description and chat link can match invite links
+            index.add(entity)
+            self.results.update(entity, entity.details())
+            if self.cache:
+                self.cache.save_details(entity)
+            self.metrics.increment('enrich_done')
+
+        await asyncio.gather(*(fetch_details(entity) for entity in stale))
+        return selected
+
+    def categorize_dialogs(self, index):
+        """Add every indexed dialog not already in the results"""
+        for entity in index:
+            try:
+                self.add_dialog_result(entity)
+            except Exception as e:
+                logger.warning(f"Error processing dialog: {e}")
+                continue
+
+    def add_dialog_result(self, entity):
+        """Record a dialog unless the results already have its id"""
+        if entity.id in self.results:
+            return
+        self.results.add(entity)
+        if entity.category:
+            logger.info(f"Found {CATEGORY_LABELS[entity.category]}: {entity.title}")
+
+    async def resolve_usernames(self, index, usernames):
+        """Resolve usernames, answering from the dialog index first and looking up the rest"""
+        self.metrics.increment('usernames_total', len(usernames))
+        logger.info(f"\nLooking up {len(usernames)} usernames...")
+
+        remaining = []
+        for username in usernames:
+            entity = index.find_by_username(username)
+            if entity:
+                self.add_username_result(username, entity)
+                self.metrics.increment('usernames_done')
+            else:
+                remaining.append(username)
+        logger.info(f"{len(usernames) - len(remaining)} found in existing dialogs, "
+                    f"{len(remaining)} to look up")
+
+        # Telegram resolves usernames one at a time whatever the client call,
+        # so each is its own request, limited and paused as resolve_username
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def lookup(username):
+            async with semaphore:
+                entity = await self.lookup_username(index, username)
+            # Counted whether or not it was found, so progress reaches the total
+            self.metrics.increment('usernames_done')
+            if entity:
+                self.add_username_result(username, entity)
+
+        await asyncio.gather(*(lookup(username) for username in remaining))
+
+    async def lookup_username(self, index, username):
+        """Look up a single username with get_chat; return its entity or None"""
+        try:
+            account, chat = await self.pool.call('resolve_username', 'get_chat', username)
+        except Exception as e:
+            logger.warning(f"Error looking up @{username}: {str(e)}")
+            return None
+        return index.add(chat, account.number)
+
+    def add_username_result(self, username, entity):
+        """Record an entity looked up by username"""
+        entity = self.results.add(entity)
+        if self.checkpoint and username not in self.checkpoint.usernames:
+            self.checkpoint.add_username(username, entity)
+        logger.info(f"Found @{username}: {entity.title} (Type: {entity.type})")
+
+    async def resolve_invite_link(self, index, link):
+        """Resolve a single invite link to an entity, joining the chat if needed"""
+        logger.info(f"\nProcessing invite link: {link}")
+
+        # Extract the invite hash from the link
+        invite_hash = invite_hash_from_link(link)
+
+        # Links resolved by a previous run need no network work at all
+        if self.cache and invite_hash:
+            chat_id = self.cache.get_invite(invite_hash)
+            entity = index.get(chat_id) if chat_id is not None else None
+            self.cache.record('invite_links', entity is not None)
+            if entity:
+                logger.info(f"[{link}] Found in cache: {entity.title} (Type: {entity.type})")
+                return entity
+
+        entity = await self.find_invite_link_chat(index, link, invite_hash)
+        if entity and self.cache and invite_hash:
+            self.cache.save_invite(invite_hash, entity.id)
+        return entity
+
+    async def find_invite_link_chat(self, index, link, invite_hash):
+        """Find the chat behind an invite link in the dialogs, or by joining it"""
+        # Try to find the chat in existing dialogs
+        entity = index.find_by_invite_hash(invite_hash)
+        if entity:
+            logger.info(f"[{link}] Found in existing dialogs: {entity.title} (Type: {entity.type})")
+            return entity
+
+        # If not found in dialogs, try to join
+        logger.info(f"[{link}] Not found in existing dialogs. Attempting to join chat...")
+        start = time.perf_counter()
+        try:
+            account, chat = await self.pool.call('join_chat', 'join_chat', link)
+            self.metrics.observe('join', time.perf_counter() - start)
+            entity = index.add(chat, account.number)
+            if self.cache:
+                self.cache.save_entity(entity)
+            logger.info(f"[{link}] Successfully joined: {entity.title} (Type: {entity.type})")
+            return entity
+        except Exception as e:
+            self.metrics.observe('join', time.perf_counter() - start)
+            # Check if the error is because we're already a member
+            if "USER_ALREADY_PARTICIPANT" not in str(e):
+                # If it's a different error, re-raise it
+                raise e
+            account = e.account
+
+        logger.info(f"[{link}] Already a member of this chat. Trying to get chat info directly...")
+        entity, path = await self.resolver.resolve(account, link, invite_hash)
+        if entity:
+            logger.info(f"[{link}] Found chat via {path}: {entity.title} (Type: {entity.type})")
+        return entity
+
     def save_results(self):
         """Save results to a JSON file"""
-        # Remove invite_links category from final output to avoid duplicates
-        results_to_save = {k: v for k, v in self.results.items() if k != 'invite_links'}
+        writer = self.results.writer
+        if writer:
+            # Entities were already written while fetching; only finish the file
+            with self.metrics.phase('save'):
+                writer.close()
+            print(f"\nResults have been streamed to {writer.path}")
+            print("\nResults Summary:")
+            for category, count in writer.counts.items():
+                print(f"{category.upper()}: {count} found")
+            return
+
+        # invite_links is only a view over the other categories, so it is not saved
+        results_to_save = self.results.to_dict()
         
-        with open('telegram_ids.json', 'w', encoding='utf-8') as f:
-            json.dump(results_to_save, f, indent=4, ensure_ascii=False)
-        print("\nResults have been saved to telegram_ids.json")
+        with self.metrics.phase('save'):
+            with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+                json.dump(results_to_save, f, indent=4, ensure_ascii=False)
+        print(f"\nResults have been saved to {OUTPUT_FILE}")
+
+        if not logger.isEnabledFor(logging.INFO):
+            # Quiet mode: counts only instead of every entity
+            for category, items in results_to_save.items():
+                print(f"{category.upper()}: {len(items)} found")
+            return
         
         try:
             # Also print results to console
@@ -333,21 +1838,437 @@ class TelegramIDFetcher:
                         print(f"ID: {item['id']} (Error displaying details)")
                         print("-" * 30)
 
-async def main():
-    # Get invite links from command line arguments
+class FetcherService:
+    """Local HTTP service in front of a long-running TelegramIDFetcher.
+
+    The fetcher keeps one connected client for the lifetime of the service:
+
+        GET /resolve?q=<invite link or username>  the entity as JSON
+        GET /dialogs                              every dialog as a JSON list
+        GET /snapshot                             the categorized results
+        GET /metrics                              timings and counters (JSON)
+
+    Concurrent requests for the same target share a single lookup.
+    """
+
+    REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 502: 'Bad Gateway'}
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+
+    async def serve_forever(self, host='127.0.0.1', port=None, path=None):
+        """Serve on a TCP port, or on a Unix socket if path is given"""
+        if path:
+            server = await asyncio.start_unix_server(self.handle, path=path)
+            logger.info(f"Serving on unix socket {path}")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            logger.info(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            # Headers are not needed; read up to the blank line that ends them
+            while (await reader.readline()).strip():
+                pass
+            try:
+                method, target, _ = request_line.split(' ', 2)
+            except ValueError:
+                status, body = 400, {'error': 'malformed request'}
+            else:
+                url = urllib.parse.urlsplit(target)
+                try:
+                    status, body = await self.dispatch(method, url.path, urllib.parse.parse_qs(url.query))
+                except Exception as e:
+                    # Always answer, even if the fetcher fails (e.g. while connecting or crawling)
+                    logger.warning(f"Error handling {method} {url.path}: {e}")
+                    status, body = 502, {'error': str(e)}
+
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status} {self.REASONS[status]}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, query):
+        """Return (status, JSON body) for a request"""
+        if method != 'GET':
+            return 405, {'error': 'only GET is supported'}
+
+        if path == '/resolve':
+            target = query.get('q', [''])[0]
+            try:
+                entity = await self.fetcher.resolve(target)
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            except Exception as e:
+                return 502, {'error': str(e)}
+            if entity is None:
+                return 404, {'error': f"could not resolve {target}"}
+            return 200, {'category': entity.category, **entity.to_dict()}
+
+        if path == '/dialogs':
+            return 200, [
+                {'category': entity.category, **entity.to_dict()}
+                async for entity in self.fetcher.iter_dialogs()
+            ]
+
+        if path == '/snapshot':
+            return 200, await self.fetcher.snapshot()
+
+        if path == '/metrics':
+            return 200, self.fetcher.metrics.to_dict()
+
+        return 404, {'error': f"unknown path {path}"}
+
+
+def read_saved_results(path):
+    """Yield (category, item) for every entity in a saved JSON or NDJSON output file.
+
+    NDJSON update lines are merged into the entity with the same id, later
+    values winning, and each entity is yielded once in the order of its
+    first line.
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.ndjson'):
+            merged = {}
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    # A line still being written by a --stream run
+                    continue
+                category = item.pop('category', None)
+                existing = merged.get(item.get('id'))
+                if existing is None:
+                    merged[item.get('id')] = (category, item)
+                else:
+                    existing[1].update(item)
+            yield from merged.values()
+            return
+        for category, items in json.load(f).items():
+            for item in items:
+                yield category, item
+
+
+def search_saved_results(path, entity_id=None, username=None, title=None, category=None):
+    """Yield the (category, item) pairs of a saved output file that match every given filter"""
+    username = username.lower() if username else None
+    title = title.casefold() if title else None
+    for item_category, item in read_saved_results(path):
+        if entity_id is not None and item.get('id') != entity_id:
+            continue
+        if username and (item.get('username') or '').lower() != username:
+            continue
+        if title and title not in (item.get('title') or '').casefold():
+            continue
+        if category and item_category != category:
+            continue
+        yield item_category, item
+
+
+class ResultIndex:
+    """Indexed SQLite copy of a saved output file for fast offline lookups.
+
+    The index remembers the size and modification time of the file it was
+    built from and is rebuilt when they change. Lookups open it read-only
+    and memory-mapped, so they only touch the pages they need.
+    """
+
+    def __init__(self, path=QUERY_INDEX_FILE):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA query_only = ON")
+        self.db.execute(f"PRAGMA mmap_size = {QUERY_MMAP_SIZE}")
+
+    @classmethod
+    def open(cls, source, path=QUERY_INDEX_FILE):
+        """Open the index of a saved output file, building it first if it is missing or stale"""
+        stat = os.stat(source)
+        signature = f"{os.path.abspath(source)}:{stat.st_size}:{stat.st_mtime_ns}"
+        if os.path.exists(path):
+            index = cls(path)
+            try:
+                row = index.db.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+            except sqlite3.DatabaseError:
+                row = None
+            if row and row[0] == signature:
+                return index
+            index.close()
+        cls.build(source, path, signature)
+        return cls(path)
+
+    @staticmethod
+    def build(source, path, signature):
+        """Index a saved output file; the index is replaced atomically for concurrent readers"""
+        temporary = f"{path}.{os.getpid()}.tmp"
+        db = sqlite3.connect(temporary)
+        try:
+            db.executescript("""
+                CREATE TABLE entities (
+                    id INTEGER,
+                    category TEXT,
+                    username_key TEXT,
+                    title_key TEXT,
+                    data TEXT
+                );
+                CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            """)
+            db.executemany("INSERT INTO entities VALUES (?, ?, ?, ?, ?)", (
+                (item.get('id'), category, (item.get('username') or '').lower(),
+                 (item.get('title') or '').casefold(), json.dumps(item, ensure_ascii=False))
+                for category, item in read_saved_results(source)
+            ))
+            db.executescript("""
+                CREATE INDEX entities_id ON entities (id);
+                CREATE INDEX entities_username ON entities (username_key);
+                CREATE INDEX entities_category ON entities (category);
+            """)
+            db.execute("INSERT INTO meta VALUES ('source', ?)", (signature,))
+            db.commit()
+            db.close()
+            os.replace(temporary, path)
+        except BaseException:
+            db.close()
+            os.remove(temporary)
+            raise
+
+    def search(self, entity_id=None, username=None, title=None, category=None):
+        """Yield the (category, item) pairs that match every given filter, in file order"""
+        clauses = []
+        params = []
+        if entity_id is not None:
+            clauses.append("id = ?")
+            params.append(entity_id)
+        if username:
+            clauses.append("username_key = ?")
+            params.append(username.lower())
+        if title:
+            clauses.append("instr(title_key, ?) > 0")
+            params.append(title.casefold())
+        if category:
+            clauses.append("category = ?")
+            params.append(category)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        for item_category, data in self.db.execute(f"SELECT category, data FROM entities{where} ORDER BY rowid",
+                                                   params):
+            yield item_category, json.loads(data)
+
+    def close(self):
+        self.db.close()
+
+
+def parse_query_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="get_telegram_ids.py query",
+        description="Look up entities in saved results without connecting to Telegram"
+    )
+    parser.add_argument('--file',
+                        help=f"saved results to search (default: {OUTPUT_FILE}, or {STREAM_FILE} if it is missing)")
+    parser.add_argument('--id', type=int, help="exact chat or user id")
+    parser.add_argument('--username', help="exact username, case-insensitive, with or without @")
+    parser.add_argument('--title', metavar='TEXT', help="case-insensitive substring of the title")
+    parser.add_argument('--category', choices=CATEGORIES)
+    parser.add_argument('--limit', type=int, metavar='N', help="print at most N matches")
+    parser.add_argument('--ids', action='store_true', help="print only the ids instead of JSON lines")
+    parser.add_argument('--index', choices=['auto', 'always', 'never'], default='auto',
+                        help=f"search through {QUERY_INDEX_FILE}: always, never, or for output files "
+                             f"of {QUERY_INDEX_MIN_SIZE // (1024 * 1024)} MB or more (default: auto)")
+    return parser.parse_args(argv)
+
+def query(argv=None):
+    """Run the offline query subcommand; return the exit status (1 if nothing matched)"""
+    args = parse_query_args(argv)
+    source = args.file or (OUTPUT_FILE if os.path.exists(OUTPUT_FILE) or not os.path.exists(STREAM_FILE)
+                           else STREAM_FILE)
+    if not os.path.exists(source):
+        print(f"No saved results in {source}; run get_telegram_ids.py first", file=sys.stderr)
+        return 2
+
+    filters = {
+        'entity_id': args.id,
+        'username': args.username.lstrip('@') if args.username else None,
+        'title': args.title,
+        'category': args.category,
+    }
+    use_index = args.index == 'always' or (
+        args.index == 'auto' and os.path.getsize(source) >= QUERY_INDEX_MIN_SIZE
+    )
+    index = ResultIndex.open(source) if use_index else None
+    matches = index.search(**filters) if index else search_saved_results(source, **filters)
+
+    if hasattr(sys.stdout, 'reconfigure'):
+        # Like the console handler: emoji in titles must not crash a legacy console
+        sys.stdout.reconfigure(errors='replace')
+    found = 0
+    try:
+        for category, item in matches:
+            if args.limit is not None and found >= args.limit:
+                break
+            found += 1
+            print(item.get('id') if args.ids else json.dumps({'category': category, **item}, ensure_ascii=False))
+    finally:
+        if index:
+            index.close()
+    return 0 if found else 1
+
+def enrich_selector(value):
+    """Parse an --enrich value: a category name, 'all' or a chat id"""
+    if value == 'all' or value in CATEGORIES:
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected {', '.join(CATEGORIES)}, all or a chat id, got {value!r}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fetch IDs of the Telegram channels, groups, bots and users you have access to",
+        epilog="To search saved results offline without connecting, run: get_telegram_ids.py query --help"
+    )
+    parser.add_argument('targets', nargs='*',
+                        help="invite links (https://t.me/+hash, https://t.me/joinchat/hash) "
+                             "or usernames (@name, https://t.me/name) to resolve")
+    parser.add_argument('--input', action='append', default=[], metavar='FILE',
+                        help="read invite links and usernames from FILE, one per line ('-' for stdin); "
+                             "can be given more than once")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"number of invite links resolved at the same time (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument('--history-scan', type=int, default=0, metavar='N',
+                        help="for links to chats you are already in that cannot be resolved otherwise, "
+                             "search recent messages of up to N dialogs (default: 0, disabled)")
+    parser.add_argument('--enrich', nargs='+', type=enrich_selector, default=[], metavar='CATEGORY_OR_ID',
+                        help="fetch full details (description, member count, linked chat, invite link) "
+                             f"for dialogs in these categories ({', '.join(CATEGORIES)}, all) or with these ids; "
+                             "details cached within --max-age are reused")
+    parser.add_argument('--stream', action='store_true',
+                        help=f"write entities to {STREAM_FILE} as they are found instead of {OUTPUT_FILE}")
+    parser.add_argument('--resume', action='store_true',
+                        help=f"continue an interrupted run from its checkpoint ({CHECKPOINT_FILE}) "
+                             "and, with --stream, its partial output file")
+    parser.add_argument('--checkpoint-interval', type=float, default=DEFAULT_CHECKPOINT_INTERVAL,
+                        metavar='SECONDS',
+                        help=f"seconds between checkpoint writes (default: {DEFAULT_CHECKPOINT_INTERVAL})")
+    parser.add_argument('--quiet', action='store_true',
+                        help="only print warnings, errors and a periodic progress line")
+    parser.add_argument('--progress-interval', type=float, default=10, metavar='SECONDS',
+                        help="seconds between progress lines in --quiet mode (default: 10)")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="write timings and API call counts to FILE at exit "
+                             "(Prometheus text for .prom/.txt, JSON otherwise)")
+    parser.add_argument('--serve', metavar='[HOST:]PORT',
+                        help="keep the connection open and answer lookups over HTTP instead of exiting")
+    parser.add_argument('--socket', metavar='PATH',
+                        help="like --serve, but listen on a Unix socket")
+    parser.add_argument('--refresh', action='store_true',
+                        help=f"ignore the entity cache ({CACHE_FILE}) and crawl everything again")
+    parser.add_argument('--max-age', type=float, default=DEFAULT_CACHE_MAX_AGE / 3600,
+                        help="hours before cached entities and invite links are refreshed "
+                             f"(default: {DEFAULT_CACHE_MAX_AGE // 3600})")
+    return parser.parse_args(argv)
+
+def collect_targets(arguments, input_files):
+    """Read, normalize and de-duplicate targets; return (invite_links, usernames)"""
+    def lines():
+        yield from arguments
+        for path in input_files:
+            if path == '-':
+                yield from sys.stdin
+            else:
+                with open(path, encoding='utf-8') as f:
+                    yield from f
+
     invite_links = []
-    if len(sys.argv) > 1:
-        for arg in sys.argv[1:]:
-            if 't.me/' in arg:
-                invite_links.append(arg)
-                print(f"Added invite link to process: {arg}")
-    
-    fetcher = TelegramIDFetcher()
-    success = await fetcher.fetch_with_pyrogram(invite_links)
+    usernames = []
+    for kind, value in read_targets(lines()):
+        if kind == 'invite_link':
+            invite_links.append(value)
+        else:
+            usernames.append(value)
+    return invite_links, usernames
+
+async def serve(args, cache, metrics):
+    """Run the long-running service mode"""
+    host, _, port = (args.serve or '').rpartition(':')
+    fetcher = TelegramIDFetcher(concurrency=args.concurrency, cache=cache, history_budget=args.history_scan,
+                                metrics=metrics, enrich=args.enrich)
+    try:
+        async with fetcher:
+            await FetcherService(fetcher).serve_forever(host or '127.0.0.1', int(port) if port else None, args.socket)
+    except RuntimeError as e:
+        logger.error(f"Error: {e}")
+    finally:
+        cache.close()
+
+async def main():
+    args = parse_args()
+    configure_logging(args.quiet)
+    metrics = Metrics()
+
+    # Get invite links and usernames from command line arguments and input files
+    invite_links, usernames = collect_targets(args.targets, args.input)
+    logger.info(f"Added {len(invite_links)} invite links and {len(usernames)} usernames to process")
+
+    cache = EntityCache(CACHE_FILE, max_age=args.max_age * 3600, refresh=args.refresh)
+
+    if args.serve or args.socket:
+        await serve(args, cache, metrics)
+        return
+
+    if not args.resume and Checkpoint.has_records(CHECKPOINT_FILE):
+        logger.error(f"{CHECKPOINT_FILE} holds the progress of an interrupted run. Run again with --resume "
+                     f"to continue it, or delete the file to start over.")
+        cache.close()
+        return
+
+    writer = NDJSONWriter(STREAM_FILE, resume=args.resume) if args.stream else None
+    checkpoint = Checkpoint(CHECKPOINT_FILE, interval=args.checkpoint_interval, resume=args.resume)
+    fetcher = TelegramIDFetcher(concurrency=args.concurrency, cache=cache, writer=writer,
+                                history_budget=args.history_scan, metrics=metrics, checkpoint=checkpoint,
+                                enrich=args.enrich)
+    progress = asyncio.ensure_future(metrics.report_progress(args.progress_interval)) if args.quiet else None
+    success = False
+    try:
+        success = await fetcher.fetch_with_pyrogram(invite_links, usernames)
+    finally:
+        if progress:
+            progress.cancel()
+        cache.close()
+        checkpoint.close()
+        if not success:
+            # Also reached on Ctrl-C: keep the checkpoint and save what was found so far
+            logger.error("Failed to fetch Telegram IDs")
+            journaled = Checkpoint.has_records(CHECKPOINT_FILE)
+            if not journaled:
+                # Failed before any progress (e.g. missing credentials): nothing to resume
+                checkpoint.remove()
+            if fetcher.index is not None:
+                fetcher.categorize_dialogs(fetcher.index)
+            if len(fetcher.results):
+                fetcher.save_results()
+                if journaled:
+                    logger.error(f"Saved partial results; run again with --resume to continue from {CHECKPOINT_FILE}")
+        if writer:
+            writer.close()
     if success:
         fetcher.save_results()
-    else:
-        print("Failed to fetch Telegram IDs")
+        # Only forget the progress once the results are safely on disk
+        checkpoint.remove()
+
+    if args.quiet:
+        print(metrics.progress_line(), flush=True)
+    if args.metrics:
+        metrics.write(args.metrics)
+        print(f"Metrics have been saved to {args.metrics}")
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ['query']:
+        sys.exit(query(sys.argv[2:]))
     asyncio.run(main())